@@ -1,4 +1,6 @@
 from django.contrib import admin
-from .models import Event
+from .models import Event, FailedDelivery, OutboxEvent
 
 admin.site.register(Event)
+admin.site.register(FailedDelivery)
+admin.site.register(OutboxEvent)
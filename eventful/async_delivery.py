@@ -0,0 +1,53 @@
+import time
+import asyncio
+
+import aiohttp
+from django.conf import settings
+
+from eventful.delivery import metrics
+
+
+async def _post(session, webhook, event, body, headers):
+    start = time.monotonic()
+    success = False
+    try:
+        async with session.post(webhook, data=body.encode(), headers=headers) as response:
+            await response.read()
+            response.raise_for_status()
+        success = True
+        return None
+    except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+        return error
+    finally:
+        metrics.record(time.monotonic() - start, success)
+
+
+async def _post_all(deliveries):
+    connector = aiohttp.TCPConnector(limit=settings.WEBHOOK_ASYNC_CONCURRENCY,
+                                     limit_per_host=settings.WEBHOOK_POOL_MAXSIZE)
+    timeout = aiohttp.ClientTimeout(sock_connect=settings.WEBHOOK_CONNECT_TIMEOUT,
+                                    sock_read=settings.WEBHOOK_READ_TIMEOUT)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        return await asyncio.gather(*(_post(session, *delivery) for delivery in deliveries))
+
+
+def deliver_many(deliveries):
+    """
+    POST many webhooks concurrently on an event loop, the worker waits on all the round trips at once.
+
+    At most `settings.WEBHOOK_ASYNC_CONCURRENCY` requests are in flight, and at most
+    `settings.WEBHOOK_POOL_MAXSIZE` of them to the same host, so a slow subscriber only holds its own slots.
+    The body is the same `{"event", "payload"}` json `notify` sends.
+
+    Args:
+        deliveries (List[Tuple]): (webhook, event, body, headers) of each webhook to call.
+
+    Returns:
+        List: None for each delivered webhook or the error it failed with, in the order of `deliveries`.
+    """
+
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(_post_all(deliveries))
+    finally:
+        loop.close()
@@ -0,0 +1,221 @@
+import os
+import hmac
+import time
+import random
+import hashlib
+import logging
+import threading
+from decimal import Decimal
+
+import orjson
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# A summary of the deliveries is logged every this many webhook requests.
+METRICS_LOG_INTERVAL = 100
+
+# Answers worth retrying besides the server errors, any other client error would be answered again.
+RETRY_STATUSES = (408, 425, 429)
+
+# The header carrying the HMAC-SHA256 of the body, keyed by the secret of the subscription.
+SIGNATURE_HEADER = "X-Webhook-Signature"
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session():
+    """
+    Return the HTTP session of this worker process, its connections are kept alive between webhooks.
+
+    Each process gets its own session, so celery's prefork workers never share sockets with their parent.
+    At most `settings.WEBHOOK_POOL_MAXSIZE` connections are open to a host at a time, requests wait
+    for a free one, and the pools of the `settings.WEBHOOK_POOL_CONNECTIONS` most recent hosts are kept.
+    """
+
+    pid = os.getpid()
+    session = _sessions.get(pid)
+    if session is not None:
+        return session
+
+    with _sessions_lock:
+        if pid not in _sessions:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=settings.WEBHOOK_POOL_CONNECTIONS,
+                                  pool_maxsize=settings.WEBHOOK_POOL_MAXSIZE,
+                                  pool_block=True)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _sessions.clear()
+            _sessions[pid] = session
+        return _sessions[pid]
+
+
+def _pools(session):
+    # the same adapter is mounted for http and https
+    adapters = {id(adapter): adapter for adapter in session.adapters.values()}
+    for adapter in adapters.values():
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is not None:
+                yield pool
+
+
+class DeliveryMetrics:
+    """
+    Count the webhook deliveries of this process, their latency and how often connections are reused.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.deliveries = 0
+            self.failures = 0
+            self.total_latency = 0.0
+            self.max_latency = 0.0
+
+    def record(self, latency, success):
+        with self._lock:
+            self.deliveries += 1
+            self.failures += not success
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+            deliveries = self.deliveries
+
+        if deliveries % METRICS_LOG_INTERVAL == 0:
+            logger.info(f"Webhook deliveries {self.snapshot()}")
+
+    def snapshot(self, session=None):
+        """
+        Return the metrics collected so far.
+
+        Returns:
+            Dict: the number of deliveries and failures, the average and max latency in seconds,
+                the number of requests sent on the open pools and the connections they opened.
+        """
+
+        pools = list(_pools(session or get_session()))
+        requests_sent = sum(pool.num_requests for pool in pools)
+        connections = sum(pool.num_connections for pool in pools)
+
+        with self._lock:
+            return {
+                "deliveries": self.deliveries,
+                "failures": self.failures,
+                "average_latency": self.total_latency / self.deliveries if self.deliveries else 0.0,
+                "max_latency": self.max_latency,
+                "requests": requests_sent,
+                "connections": connections,
+                "reused_connections": max(requests_sent - connections, 0),
+            }
+
+
+metrics = DeliveryMetrics()
+
+
+def _default(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+def serialize(event, payload):
+    """
+    Return the json body of a webhook, it is serialized once and the same bytes are sent on every attempt.
+    Dates are written in ISO format and decimals as strings, like the django json encoder does.
+
+    Args:
+        event (str): The event happened.
+        payload (Dict|List): The payload of the event.
+
+    Returns:
+        str: the `{"event", "payload"}` json body.
+    """
+
+    return orjson.dumps({"event": event, "payload": payload}, default=_default).decode()
+
+
+def deserialize(body):
+    """Return the payload of a body written by `serialize`."""
+
+    return orjson.loads(body)["payload"]
+
+
+def signer(secret):
+    """Return the HMAC of the secret without any data yet, `sign` copies it for each body."""
+
+    return hmac.new(secret.encode(), digestmod=hashlib.sha256)
+
+
+def sign(signer, body):
+    """Return the signature header value of a body for the HMAC returned by `signer`."""
+
+    signature = signer.copy()
+    signature.update(body.encode())
+    return f"sha256={signature.hexdigest()}"
+
+
+def post(url, body, headers):
+    """
+    POST a webhook with the pooled session of this process and the configured timeouts.
+
+    Args:
+        url (str): The webhook to call.
+        body (str): The json body of the request, see `serialize`.
+        headers (Dict): The headers of the request.
+
+    Returns:
+        Response: the response of the webhook, whatever its status code is.
+
+    Raises:
+        RequestException: if the webhook can not be reached or is too slow to answer.
+    """
+
+    start = time.monotonic()
+    success = False
+    try:
+        response = get_session().post(
+            url,
+            data=body.encode(),
+            headers=headers,
+            timeout=(settings.WEBHOOK_CONNECT_TIMEOUT, settings.WEBHOOK_READ_TIMEOUT),
+        )
+        success = response.ok
+        return response
+    finally:
+        latency = time.monotonic() - start
+        metrics.record(latency, success)
+        logger.debug(f"Webhook {url} answered in {latency:.3f}s")
+
+
+def is_retryable(error):
+    """
+    Tell if a failed delivery may succeed later, timeouts, connection and server errors are retried.
+
+    Args:
+        error (Exception): the error of a requests or aiohttp delivery.
+    """
+
+    status = getattr(error, 'status', None)
+    response = getattr(error, 'response', None)
+    if status is None and response is not None:
+        status = response.status_code
+    return status is None or status >= 500 or status in RETRY_STATUSES
+
+
+def backoff(retries):
+    """
+    Return the seconds to wait before retrying a delivery that failed `retries + 1` times.
+    The wait doubles with every attempt up to `settings.WEBHOOK_RETRY_BACKOFF_MAX`, and is drawn at random
+    below that so the retries of the deliveries failing together in an outage don't come back together.
+    """
+
+    ceiling = min(settings.WEBHOOK_RETRY_BACKOFF * 2**retries, settings.WEBHOOK_RETRY_BACKOFF_MAX)
+    return random.uniform(0, ceiling)
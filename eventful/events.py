@@ -0,0 +1,95 @@
+class EventType:
+    """
+    A kind of event the users can subscribe their webhooks to.
+
+    Args:
+        name (str): The `event_name` of the subscriptions.
+        description (str): What happened, shown to the subscribers.
+        fields (Tuple[str]): The fields every payload of the event has.
+        coalesce_key (str): The payload field naming what the event is about, a batch keeps only
+            the latest payload for each one. None keeps all of them.
+    """
+
+    def __init__(self, name, description, fields, coalesce_key=None):
+        self.name = name
+        self.description = description
+        self.fields = tuple(fields)
+        self.coalesce_key = coalesce_key
+
+    def check(self, payload):
+        """
+        Check that the payload has the fields of this event.
+
+        Raises:
+            ValueError: if a field is missing.
+        """
+
+        missing = [field for field in self.fields if field not in payload]
+        if missing:
+            raise ValueError(f"The payload of {self.name} is missing {', '.join(missing)}")
+        return payload
+
+    def __str__(self):
+        return self.name
+
+
+REGISTRY = {}
+
+
+def register(name, description, fields, coalesce_key=None):
+    """Add a new event type to the registry, the users can subscribe to it once it is migrated."""
+
+    if name in REGISTRY:
+        raise ValueError(f"Event {name} is already registered")
+    REGISTRY[name] = EventType(name, description, fields, coalesce_key)
+    return REGISTRY[name]
+
+
+def get_event_type(name):
+    """
+    Return the registered event type of the name.
+
+    Raises:
+        ValueError: if there is no such event.
+    """
+
+    try:
+        return REGISTRY[name]
+    except KeyError:
+        raise ValueError(f"Unknown event {name}")
+
+
+# The fields of `Shipment.to_dict`, every shipment event has them.
+SHIPMENT_FIELDS = ("title", "receiver_name", "receiver_country", "receiver_address", "weight", "state",
+                   "tracking_id", "estimated_shipping_date", "scheduled_at", "lat", "lon")
+
+SHIPMENT_STATE_CHANGED = register(
+    "SHIPMENT_STATE_CHANGED",
+    "The state of a shipment changed",
+    SHIPMENT_FIELDS,
+    coalesce_key="tracking_id",
+)
+SHIPMENT_SCHEDULED = register(
+    "SHIPMENT_SCHEDULED",
+    "A shipment was scheduled for delivery",
+    SHIPMENT_FIELDS,
+    coalesce_key="tracking_id",
+)
+SHIPMENT_DRIVER_ASSIGNED = register(
+    "SHIPMENT_DRIVER_ASSIGNED",
+    "A driver was assigned to a shipment",
+    SHIPMENT_FIELDS + ("driver_id", ),
+    coalesce_key="tracking_id",
+)
+# every payload names only the documents attached by its request, none of them is dropped from a batch
+SHIPMENT_DOCUMENTS_ATTACHED = register(
+    "SHIPMENT_DOCUMENTS_ATTACHED",
+    "Documents were attached to a shipment",
+    SHIPMENT_FIELDS + ("documents", ),
+)
+SHIPMENT_ETA_CHANGED = register(
+    "SHIPMENT_ETA_CHANGED",
+    "The estimated shipping date of a shipment was set or changed",
+    SHIPMENT_FIELDS + ("previous_estimated_shipping_date", ),
+    coalesce_key="tracking_id",
+)
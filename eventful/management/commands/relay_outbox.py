@@ -0,0 +1,48 @@
+import time
+import logging
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from eventful.models import OutboxEvent
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Relay the outbox events to the celery workers, until stopped"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.OUTBOX_BATCH_SIZE,
+                            help="events relayed per transaction")
+        parser.add_argument('--interval', type=float, default=settings.OUTBOX_POLL_INTERVAL,
+                            help="seconds to wait when the outbox is empty")
+        parser.add_argument('--max-backoff', type=float, default=settings.OUTBOX_MAX_BACKOFF,
+                            help="max seconds to wait after a failed relay")
+        parser.add_argument('--once', action='store_true', help="stop once the outbox is empty")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        relayed = failures = 0
+        while True:
+            try:
+                count = OutboxEvent.objects.relay(batch_size)
+                failures = 0
+            except Exception as e:
+                # the events are kept in the outbox, e.g. while the broker is down,
+                # the wait doubles with every failure so a failing batch isn't retried in a tight loop
+                failures += 1
+                backoff = min(options['interval'] * 2 ** failures, options['max_backoff'])
+                logger.exception(f"Error {e} while relaying the outbox, retrying in {backoff} seconds")
+                if options['once']:
+                    break
+                time.sleep(backoff)
+                continue
+            relayed += count
+
+            if count < batch_size:
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+
+        self.stdout.write(f"Relayed {relayed} events")
@@ -0,0 +1,31 @@
+# Generated by Django 2.2 on 2026-10-18 19:27
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('eventful', '0002_auto_20200916_2352'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FailedDelivery',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_name', models.CharField(max_length=255)),
+                ('webhook', models.URLField()),
+                ('payload', django.contrib.postgres.fields.jsonb.JSONField()),
+                ('error', models.TextField()),
+                ('attempts', models.IntegerField(default=1)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('subscription', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='failed_deliveries', to='eventful.Event')),
+            ],
+            options={
+                'ordering': ('id',),
+            },
+        ),
+    ]
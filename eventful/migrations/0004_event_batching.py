@@ -0,0 +1,39 @@
+# Generated by Django 2.2 on 2026-10-18 19:29
+
+import django.contrib.postgres.fields.jsonb
+import django.core.serializers.json
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('eventful', '0003_failed_delivery'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='batch_size',
+            field=models.IntegerField(default=100, validators=[django.core.validators.MinValueValidator(1), django.core.validators.MaxValueValidator(1000)]),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='batch_window',
+            field=models.FloatField(default=0, validators=[django.core.validators.MinValueValidator(0), django.core.validators.MaxValueValidator(300)]),
+        ),
+        migrations.CreateModel(
+            name='PendingNotification',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(blank=True, max_length=255)),
+                ('payload', django.contrib.postgres.fields.jsonb.JSONField(encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('subscription', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pending_notifications', to='eventful.Event')),
+            ],
+            options={
+                'ordering': ('id',),
+            },
+        ),
+    ]
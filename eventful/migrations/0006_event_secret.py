@@ -0,0 +1,28 @@
+# Generated by Django 2.2 on 2026-10-18 19:37
+
+from django.db import migrations, models
+import eventful.models
+
+
+def generate_secrets(apps, schema_editor):
+    # the default is computed once for the existing rows, every subscription needs its own secret
+    Event = apps.get_model('eventful', 'Event')
+    for event in Event.objects.all():
+        event.secret = eventful.models.generate_secret()
+        event.save(update_fields=['secret'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('eventful', '0005_outbox_event'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='secret',
+            field=models.CharField(default=eventful.models.generate_secret, max_length=64),
+        ),
+        migrations.RunPython(generate_secrets, migrations.RunPython.noop),
+    ]
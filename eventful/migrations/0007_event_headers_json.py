@@ -0,0 +1,61 @@
+# Generated by Django 2.2 on 2026-10-18 19:40
+
+import ast
+import json
+import logging
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations
+
+logger = logging.getLogger(__name__)
+
+
+def parse_headers(apps, schema_editor):
+    # the headers were eval'd, rows written before the json validation may hold python literals
+    Event = apps.get_model('eventful', 'Event')
+    for event in Event.objects.exclude(headers_text__in=("", "{}")):
+        try:
+            headers = json.loads(event.headers_text)
+        except ValueError:
+            try:
+                headers = ast.literal_eval(event.headers_text)
+            except (ValueError, SyntaxError):
+                headers = None
+        if not isinstance(headers, dict):
+            # a row no request could have been sent with, it is cleared rather than aborting the migration
+            logger.warning(f"Dropping the headers of event {event.id}, not a dict: {event.headers_text!r}")
+            headers = {}
+        event.headers = {str(name): str(value) for name, value in headers.items()}
+        event.save(update_fields=['headers'])
+
+
+def format_headers(apps, schema_editor):
+    Event = apps.get_model('eventful', 'Event')
+    for event in Event.objects.all():
+        event.headers_text = json.dumps(event.headers)
+        event.save(update_fields=['headers_text'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('eventful', '0006_event_secret'),
+    ]
+
+    operations = [
+        migrations.RenameField(
+            model_name='event',
+            old_name='headers',
+            new_name='headers_text',
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='headers',
+            field=django.contrib.postgres.fields.jsonb.JSONField(blank=True, default=dict),
+        ),
+        migrations.RunPython(parse_headers, format_headers),
+        migrations.RemoveField(
+            model_name='event',
+            name='headers_text',
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 2.2 on 2026-10-18 19:41
+
+from django.conf import settings
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('eventful', '0007_event_headers_json'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='event',
+            unique_together={('user', 'event_name', 'webhook')},
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2 on 2026-10-18 19:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('eventful', '0008_multiple_subscriptions'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='event',
+            name='event_name',
+            field=models.CharField(choices=[('SHIPMENT_STATE_CHANGED', 'SHIPMENT_STATE_CHANGED'), ('SHIPMENT_SCHEDULED', 'SHIPMENT_SCHEDULED'), ('SHIPMENT_DRIVER_ASSIGNED', 'SHIPMENT_DRIVER_ASSIGNED'), ('SHIPMENT_DOCUMENTS_ATTACHED', 'SHIPMENT_DOCUMENTS_ATTACHED'), ('SHIPMENT_ETA_CHANGED', 'SHIPMENT_ETA_CHANGED')], default='SHIPMENT_STATE_CHANGED', max_length=255),
+        ),
+    ]
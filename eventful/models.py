@@ -1,26 +1,89 @@
-from django.db import models
+import secrets
+from collections import defaultdict
+
+from celery import group
+from django.db import models, transaction
 from django.conf import settings
-from eventful.tasks import notify
+from django.contrib.postgres.fields import JSONField
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.validators import MinValueValidator, MaxValueValidator
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from eventful import delivery, events
+from eventful.tasks import notify, notify_many, flush_notifications
+from eventful.subscriptions import subscriptions
+
+
+def generate_secret():
+    return secrets.token_hex(32)
+
+
+def delivery_signatures(deliveries, countdown_step=0):
+    """
+    Return the celery signatures sending the given webhooks with `settings.WEBHOOK_DISPATCHER`,
+    a task per webhook or, with the `asyncio` dispatcher, a task per batch of webhooks.
+
+    Args:
+        deliveries (List[Tuple]): the arguments of `notify` for each webhook, see `Event.delivery_args`.
+        countdown_step (float): seconds between the start of two batches of `settings.WEBHOOK_BATCH_SIZE`
+            webhooks, to spread a large backlog.
+
+    Returns:
+        List[Signature]: the signatures to send, usually as one group.
+    """
+
+    size = settings.WEBHOOK_BATCH_SIZE
+    signatures = []
+    for index, start in enumerate(range(0, len(deliveries), size)):
+        batch = deliveries[start:start + size]
+        options = {"retry": True}
+        if index and countdown_step:
+            options["countdown"] = index * countdown_step
+
+        if settings.WEBHOOK_DISPATCHER == Event.ASYNCIO:
+            # batches of webhooks are sent concurrently by one task each
+            signatures.append(notify_many.signature((batch, ), **options))
+        else:
+            signatures.extend(notify.signature(args, **options) for args in batch)
+
+    return signatures
 
 
 class Event(models.Model):
-    SHIPMENT_STATE_CHANGED = "SHIPMENT_STATE_CHANGED"
+    SHIPMENT_STATE_CHANGED = events.SHIPMENT_STATE_CHANGED.name
+
+    # `settings.WEBHOOK_DISPATCHER` values
+    CELERY = "celery"
+    ASYNCIO = "asyncio"
 
-    EVENT_CHOICES = ((SHIPMENT_STATE_CHANGED, SHIPMENT_STATE_CHANGED), )
+    EVENT_CHOICES = tuple((name, name) for name in events.REGISTRY)
+
+    MAX_BATCH_WINDOW = 300
+    MAX_BATCH_SIZE = 1000
 
     event_name = models.CharField(max_length=255, choices=EVENT_CHOICES, default=SHIPMENT_STATE_CHANGED)
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="events")
     webhook = models.URLField()
-    headers = models.TextField(default="{}")
+    # sent with every webhook request, validated as a Dict of strings on write
+    headers = JSONField(default=dict, blank=True)
     max_retry = models.IntegerField(default=1)
+    # seconds the notifications are buffered to be sent together, 0 sends each one on its own
+    batch_window = models.FloatField(default=0,
+                                     validators=[MinValueValidator(0), MaxValueValidator(MAX_BATCH_WINDOW)])
+    batch_size = models.IntegerField(default=100,
+                                     validators=[MinValueValidator(1), MaxValueValidator(MAX_BATCH_SIZE)])
+    # the key of the HMAC signing the webhooks, the subscriber checks the signature header with it
+    secret = models.CharField(max_length=64, default=generate_secret)
 
     class Meta:
-        unique_together = (('user', 'event_name'), )
+        # also the index routing the events of a user to its subscriptions
+        unique_together = (('user', 'event_name', 'webhook'), )
 
     @staticmethod
-    def dispatch(event_name, user_id, payload):
+    def publish(event_name, user_id, payload):
         """
-        Dispatch an Event to the subscribers
+        Save an Event to the outbox in the current transaction, it is dispatched by `relay_outbox`
+        once committed and is never sent for a change that is rolled back.
 
         Args:
             event_name (str): The event happened
@@ -31,19 +94,293 @@ class Event(models.Model):
             None
         """
 
-        event = Event.objects.filter(event_name=event_name, user_id=user_id)
-        if not event:
-            return
+        Event.publish_many(event_name, [(user_id, payload)])
+
+    @staticmethod
+    def publish_many(event_name, notifications):
+        """
+        Save many Events to the outbox in one query, see `publish`.
+        The relay drops the events of the users without a subscription, it sees the subscriptions as of
+        the relay rather than the ones this process may have cached.
+
+        Raises:
+            ValueError: if the event isn't registered or a payload is missing some of its fields.
+
+        Args:
+            event_name (str): The event happened
+            notifications (List[Tuple]): (user_id, payload) pairs, one per notification to send.
+
+        Returns:
+            None
+        """
+
+        event_type = events.get_event_type(event_name)
+        for _, payload in notifications:
+            event_type.check(payload)
+
+        OutboxEvent.objects.bulk_create([
+            OutboxEvent(event_name=event_name, user_id=user_id, payload=payload)
+            for user_id, payload in notifications if user_id is not None
+        ])
+
+    @staticmethod
+    def prepare_dispatch(event_name, notifications):
+        """
+        Buffer the notifications of the batching subscriptions and return the tasks sending the others.
+        The subscriptions not cached yet are fetched in one query. The tasks are sent by the caller,
+        last in its transaction so nothing is sent for changes that fail to be written.
+
+        Args:
+            event_name (str): The event happened
+            notifications (List[Tuple]): (user_id, payload) pairs, one per notification to send.
+
+        Returns:
+            List[Signature]: the webhooks to send and the flushes of the batches to schedule.
+        """
+
+        subscribed = subscriptions.get_many({user_id for user_id, _ in notifications}, event_name)
+
+        deliveries, batches = [], defaultdict(list)
+        for user_id, payload in notifications:
+            body = None
+            for event in subscribed.get(user_id, ()):
+                if event.batch_window:
+                    batches[event].append(payload)
+                    continue
+                # the same body is signed for each subscription
+                body = body or delivery.serialize(event_name, payload)
+                deliveries.append(event.delivery_args(event_name, payload, body))
+
+        # the subscriptions are locked in the same order by every dispatch, so they can't deadlock
+        signatures = delivery_signatures(deliveries)
+        for event in sorted(batches, key=lambda event: event.id):
+            signatures.extend(event.buffer(batches[event]))
+        return signatures
+
+    def buffer(self, payloads):
+        """
+        Keep the payloads to send them with the others of the current batch, `flush_pending()` sends them.
+        A batch is sent `batch_window` seconds after its first payload, or as soon as it has `batch_size`.
+        The subscription is locked until the transaction ends, so a flush can't miss the payloads buffered
+        meanwhile. A flush that is lost is sent by `flush_stale_notifications`.
+
+        Args:
+            payloads (List[Dict]): the payloads of the notifications to send.
+
+        Returns:
+            List[Signature]: the flush to schedule, to send once the payloads are buffered.
+        """
+
+        key_field = events.get_event_type(self.event_name).coalesce_key
+        with transaction.atomic():
+            if not self._lock():
+                # deleted since it was cached
+                return []
+
+            pending = self.pending_notifications.count()
+            PendingNotification.objects.bulk_create([
+                PendingNotification(subscription=self,
+                                    key=str(payload.get(key_field, "")) if key_field else "",
+                                    payload=payload) for payload in payloads
+            ])
+
+        if pending + len(payloads) >= self.batch_size:
+            return [flush_notifications.signature((self.id, ))]
+        if not pending:
+            return [flush_notifications.signature((self.id, ), countdown=self.batch_window)]
+        return []
+
+    def flush_pending(self):
+        """
+        Send up to `batch_size` buffered payloads in one webhook whose payload is their list.
+        The payloads with the same key are collapsed into the latest one, in the place of the latest one.
+        The webhook is sent to the broker before the removal of the payloads is committed, if it fails
+        they are kept for the next flush.
+
+        Returns:
+            int: the number of payloads sent.
+        """
+
+        with transaction.atomic():
+            if not self._lock():
+                return 0
+
+            pending = list(self.pending_notifications.all()[:self.batch_size])
+            if not pending:
+                return 0
+            PendingNotification.objects.filter(id__in=[notification.id for notification in pending]).delete()
+
+            payloads = {}
+            for notification in pending:
+                key = notification.key or notification.id
+                payloads.pop(key, None)
+                payloads[key] = notification.payload
+
+            remaining = self.pending_notifications.count()
+            notify.apply_async(self.delivery_args(self.event_name, list(payloads.values())), retry=True)
+            if remaining >= self.batch_size:
+                flush_notifications.delay(self.id)
+            elif remaining:
+                flush_notifications.apply_async((self.id, ), countdown=self.batch_window)
+
+        return len(payloads)
+
+    def _lock(self):
+        """Lock the row of the subscription until the end of the transaction, False if it was deleted"""
+
+        return Event.objects.select_for_update().filter(id=self.id).exists()
+
+    def delivery_args(self, event_name, payload, body=None):
+        """
+        Return the arguments of `notify` to send the payload to this subscription's webhook,
+        the delivery is retried up to `max_retry` times and dead lettered after that.
+        The body is serialized and signed here once, every attempt sends the same bytes,
+        unless it is given already serialized by `delivery.serialize`.
+        """
+
+        body = body or delivery.serialize(event_name, payload)
+        headers = {
+            "Content-Type": "application/json",
+            **self.get_headers(),
+            delivery.SIGNATURE_HEADER: delivery.sign(self.get_signer(), body),
+        }
+        return (self.webhook, event_name, body, headers, self.max_retry, self.id)
+
+    def get_signer(self):
+        """Return the HMAC keyed by the secret of the subscription, it is computed once per secret."""
 
-        event = event.first()
+        signer = getattr(self, '_signer', None)
+        if signer is None or signer[0] != self.secret:
+            signer = self._signer = (self.secret, delivery.signer(self.secret))
+        return signer[1]
 
-        headers = eval(event.headers or "{}")  # pylint: disable=eval-used
+    def get_headers(self):
+        """Return the headers to send with the webhook request as a Dict"""
 
-        notify.apply_async(
-            (event.webhook, event_name, payload, headers),
-            retry=True,
-            retry_policy={"max_retries": event.max_retry},
-        )
+        return self.headers or {}
 
     def __str__(self):
         return f"{self.event_name} for owner {self.user.username}"
+
+
+@receiver(post_save, sender=Event)
+@receiver(post_delete, sender=Event)
+def invalidate_subscription(sender, instance, **kwargs):
+    subscriptions.invalidate(instance.user_id, instance.event_name)
+    # once more when committed, another process may have cached the previous subscription meanwhile
+    transaction.on_commit(lambda: subscriptions.invalidate(instance.user_id, instance.event_name))
+
+
+class FailedDeliveryQuerySet(models.QuerySet):
+    def redrive(self):
+        """
+        Send these failed deliveries again, to the current webhook and headers of their subscription.
+        They are removed from the dead letters, one failing again is dead lettered again.
+        They are sent to the broker before the removal is committed, if it fails they are kept,
+        so a delivery is redriven at least once.
+        Every batch of `settings.WEBHOOK_BATCH_SIZE` webhooks is sent `settings.WEBHOOK_REDRIVE_INTERVAL`
+        seconds after the previous one, so redriving a long outage floods neither the workers
+        nor the subscriber.
+
+        Returns:
+            int: the number of redriven deliveries.
+        """
+
+        with transaction.atomic():
+            failed = list(self.select_related('subscription').select_for_update(of=('self', )))
+            if not failed:
+                return 0
+
+            deliveries = [
+                delivery.subscription.delivery_args(delivery.event_name, delivery.payload)
+                for delivery in failed
+            ]
+            self.model.objects.filter(id__in=[delivery.id for delivery in failed]).delete()
+
+            group(delivery_signatures(deliveries, settings.WEBHOOK_REDRIVE_INTERVAL)).apply_async()
+
+        return len(failed)
+
+
+class FailedDelivery(models.Model):
+    """A webhook delivery that failed all its attempts, kept until it is redriven."""
+
+    subscription = models.ForeignKey(Event, on_delete=models.CASCADE, related_name="failed_deliveries")
+    event_name = models.CharField(max_length=255)
+    webhook = models.URLField()
+    payload = JSONField()
+    error = models.TextField()
+    attempts = models.IntegerField(default=1)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = FailedDeliveryQuerySet.as_manager()
+
+    class Meta:
+        ordering = ('id', )
+
+    def __str__(self):
+        return f"{self.event_name} to {self.webhook} failed after {self.attempts} attempts"
+
+
+class PendingNotification(models.Model):
+    """A notification buffered to be sent in the next batch of a batching subscription."""
+
+    subscription = models.ForeignKey(Event, on_delete=models.CASCADE, related_name="pending_notifications")
+    key = models.CharField(max_length=255, blank=True)
+    payload = JSONField(encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ('id', )
+
+
+class OutboxEventQuerySet(models.QuerySet):
+    def relay(self, batch_size=None):
+        """
+        Dispatch the oldest outbox events and remove them from the outbox, in one transaction.
+        Everything is written first, the tasks are sent to the broker last. If they can not all be sent
+        the transaction is rolled back and the events stay in the outbox for the next relay,
+        so every event is sent at least once.
+        Relays running together skip the events locked by each other.
+
+        Args:
+            batch_size (int): the number of events relayed, `settings.OUTBOX_BATCH_SIZE` by default.
+
+        Returns:
+            int: the number of relayed events.
+        """
+
+        with transaction.atomic():
+            outbox = list(self.select_for_update(skip_locked=True)[:batch_size or settings.OUTBOX_BATCH_SIZE])
+            if not outbox:
+                return 0
+
+            notifications = defaultdict(list)
+            for event in outbox:
+                notifications[event.event_name].append((event.user_id, event.payload))
+            signatures = []
+            for event_name, batch in notifications.items():
+                signatures.extend(Event.prepare_dispatch(event_name, batch))
+
+            self.model.objects.filter(id__in=[event.id for event in outbox]).delete()
+            if signatures:
+                group(signatures).apply_async()
+
+        return len(outbox)
+
+
+class OutboxEvent(models.Model):
+    """An event saved in the transaction of the change it is about, until it is relayed to the subscribers."""
+
+    event_name = models.CharField(max_length=255)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="+")
+    payload = JSONField(encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = OutboxEventQuerySet.as_manager()
+
+    class Meta:
+        ordering = ('id', )
+
+    def __str__(self):
+        return f"{self.event_name} for user {self.user_id}"
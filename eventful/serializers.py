@@ -1,21 +1,43 @@
 import json
 from rest_framework import serializers
-from eventful.models import Event
+from eventful.models import Event, FailedDelivery
 
 
 class EventSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Event
-        fields = ('id', 'event_name', 'webhook', 'max_retry', 'headers')
+        fields = ('id', 'event_name', 'webhook', 'max_retry', 'headers', 'batch_window', 'batch_size',
+                  'secret')
+        read_only_fields = ('secret', )
 
     def validate_headers(self, value):
-        try:
-            json.loads(value)
-        except Exception:
-            raise serializers.ValidationError("Not a valid json")
+        # headers used to be sent as a json string, it is still accepted
+        if isinstance(value, str):
+            try:
+                value = json.loads(value)
+            except Exception:
+                raise serializers.ValidationError("Not a valid json")
+
+        if not isinstance(value, dict) or not all(
+                isinstance(name, str) and isinstance(header, str) for name, header in value.items()):
+            raise serializers.ValidationError("Headers must be an object of string values")
         return value
 
+    def validate(self, attrs):
+        # a user may subscribe many webhooks to an event, but each one once
+        user = self.instance.user if self.instance else self.context['request'].user
+        event_name = attrs.get('event_name',
+                               getattr(self.instance, 'event_name', Event.SHIPMENT_STATE_CHANGED))
+        webhook = attrs.get('webhook', getattr(self.instance, 'webhook', None))
+
+        duplicates = Event.objects.filter(user=user, event_name=event_name, webhook=webhook)
+        if self.instance:
+            duplicates = duplicates.exclude(id=self.instance.id)
+        if duplicates.exists():
+            raise serializers.ValidationError("This webhook is already subscribed to this event")
+        return attrs
+
     def create(self, validated_data):
         """
         Create an Event object.
@@ -31,3 +53,11 @@ class EventSerializer(serializers.ModelSerializer):
         event.user = self.context['request'].user
         event.save()
         return event
+
+
+class FailedDeliverySerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = FailedDelivery
+        fields = ('id', 'subscription', 'event_name', 'webhook', 'payload', 'error', 'attempts', 'created_at')
+        read_only_fields = fields
@@ -0,0 +1,92 @@
+import time
+import uuid
+import threading
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+
+# The key of the shared cache holding the version of the subscriptions, a new one is set on every change
+VERSION_KEY = "eventful:subscriptions:version"
+
+
+class SubscriptionCache:
+    """
+    Keep the subscriptions of this process by (user_id, event_name), so dispatching an event queries
+    the database only the first time a user's subscription is looked up.
+
+    Users without a subscription are cached too, most shipment owners never subscribe.
+    Saving or deleting an `Event` sets a new version in the Django cache shared by the processes, every
+    lookup checks it and a process seeing a new version drops all its entries. Entries also expire after
+    `settings.EVENT_SUBSCRIPTION_CACHE_TTL` seconds, in case the Django cache isn't shared.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._version = None
+
+    def _current_version(self):
+        version = cache.get(VERSION_KEY)
+        if version is None:
+            # never set or evicted, a new version drops the entries cached under the lost one
+            cache.add(VERSION_KEY, uuid.uuid4().hex, None)
+            version = cache.get(VERSION_KEY)
+        return version
+
+    def get(self, user_id, event_name):
+        """
+        Return the subscriptions of the user to the event, an empty list if the user isn't subscribed.
+        """
+
+        return self.get_many([user_id], event_name).get(user_id, [])
+
+    def get_many(self, user_ids, event_name):
+        """
+        Return the subscriptions of the users to the event, the ones not cached are fetched in one query
+        on the (user, event_name) index.
+
+        Returns:
+            Dict: the list of Events of each subscribed user by its id.
+        """
+
+        now = time.monotonic()
+        version = self._current_version()
+        subscriptions, missing = {}, set()
+        with self._lock:
+            if version != self._version:
+                self._entries.clear()
+                self._version = version
+            for user_id in user_ids:
+                entry = self._entries.get((user_id, event_name))
+                if entry is None or entry[0] <= now:
+                    missing.add(user_id)
+                elif entry[1]:
+                    subscriptions[user_id] = entry[1]
+
+        if missing:
+            Event = apps.get_model('eventful', 'Event')
+            fetched = {}
+            for event in Event.objects.filter(event_name=event_name, user_id__in=missing).order_by('id'):
+                fetched.setdefault(event.user_id, []).append(event)
+            expires = now + settings.EVENT_SUBSCRIPTION_CACHE_TTL
+            with self._lock:
+                for user_id in missing:
+                    self._entries[(user_id, event_name)] = (expires, fetched.get(user_id, []))
+            subscriptions.update(fetched)
+
+        return subscriptions
+
+    def invalidate(self, user_id, event_name):
+        """Drop the subscriptions of the user to the event from this process, and the others"""
+
+        with self._lock:
+            self._entries.pop((user_id, event_name), None)
+        cache.set(VERSION_KEY, uuid.uuid4().hex, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+subscriptions = SubscriptionCache()
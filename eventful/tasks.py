@@ -1,31 +1,116 @@
 import logging
 import requests
+from datetime import timedelta
 
 from celery import shared_task
+from django.apps import apps
+from django.conf import settings
+from django.db.models import Min
+from django.utils import timezone
+
+from eventful import delivery
+from eventful.async_delivery import deliver_many
 
 logger = logging.getLogger(__name__)
 
 
-@shared_task
-def notify(webhook, event, payload, headers):
+def dead_letter(subscription_id, webhook, event, body, error, attempts):
+    """Keep a delivery that failed all its attempts, to be redriven once the subscriber is back."""
+
+    if subscription_id is None:
+        return
+
+    FailedDelivery = apps.get_model('eventful', 'FailedDelivery')
+    try:
+        FailedDelivery.objects.create(subscription_id=subscription_id,
+                                      event_name=event,
+                                      webhook=webhook,
+                                      payload=delivery.deserialize(body),
+                                      error=repr(error),
+                                      attempts=attempts)
+    except Exception as e:
+        logger.exception(f"Error {e} while dead lettering the delivery of event {event} to url {webhook}")
+
+
+@shared_task(bind=True)
+def notify(self, webhook, event, body, headers, max_retry=0, subscription_id=None):
     """
     notifies webhook by sending it POST request.
-    playload sent by caller.
+    body serialized and signed by caller, the same body is sent on every retry.
     func is celery task to allow async operation.
+    the request goes through the pooled session of the worker, slow webhooks time out.
+    failed requests are retried up to `max_retry` times with a growing delay, then dead lettered.
     :type webhook: string
     :type event: string
-    :type payload: dict
+    :type body: string
+    :type max_retry: int
+    :type subscription_id: int
     """
     try:
-        response = requests.request(
-            'POST',
-            webhook,
-            json={
-                "event": event,
-                "payload": payload
-            },
-            headers=headers,
-        )
+        response = delivery.post(webhook, body, headers)
         response.raise_for_status()
-    except requests.exceptions.HTTPError as error:
-        logger.exception(f"Error {error} while sending http request to url {webhook} with payload {payload} with headers {headers} for event {event}") # noqa
+    except requests.exceptions.RequestException as error:
+        retries = self.request.retries
+        if retries < max_retry and delivery.is_retryable(error):
+            raise self.retry(exc=error, countdown=delivery.backoff(retries), max_retries=max_retry)
+
+        logger.exception(f"Error {error} while sending http request to url {webhook} with body {body} with headers {headers} for event {event}") # noqa
+        dead_letter(subscription_id, webhook, event, body, error, retries + 1)
+
+
+@shared_task
+def notify_many(deliveries, attempt=0):
+    """
+    notifies many webhooks concurrently from one task, instead of a task per webhook.
+    the body of each request is the same one `notify` sends.
+    the failed requests are retried together in one task after a growing delay, then dead lettered.
+    :type deliveries: list of the `notify` arguments, see `Event.delivery_args`
+    :type attempt: int
+    """
+    retries = []
+    errors = deliver_many([args[:4] for args in deliveries])
+    for args, error in zip(deliveries, errors):
+        if error is None:
+            continue
+
+        webhook, event, body, headers, max_retry, subscription_id = args
+        if attempt < max_retry and delivery.is_retryable(error):
+            retries.append(args)
+            continue
+
+        logger.error(f"Error {error!r} while sending http request to url {webhook} with body {body} with headers {headers} for event {event}") # noqa
+        dead_letter(subscription_id, webhook, event, body, error, attempt + 1)
+
+    if retries:
+        notify_many.apply_async((retries, attempt + 1), countdown=delivery.backoff(attempt), retry=True)
+
+
+@shared_task
+def flush_notifications(subscription_id):
+    """
+    sends the notifications buffered by a batching subscription as one webhook.
+    func is celery task to send them once the batch window is over.
+    :type subscription_id: int
+    """
+    Event = apps.get_model('eventful', 'Event')
+    event = Event.objects.filter(id=subscription_id).first()
+    if event:
+        event.flush_pending()
+
+
+@shared_task
+def flush_stale_notifications():
+    """
+    flushes the batches whose flush was lost, e.g. the broker was down when it was scheduled.
+    a batch is stale once its oldest notification waited its batch window and a sweep interval.
+    func is celery task run by celery beat every `settings.PENDING_NOTIFICATIONS_SWEEP_INTERVAL` seconds.
+    """
+    Event = apps.get_model('eventful', 'Event')
+    now = timezone.now()
+    subscriptions = Event.objects.annotate(oldest=Min('pending_notifications__created_at')).filter(
+        oldest__isnull=False)
+    for event in subscriptions:
+        wait = timedelta(seconds=event.batch_window + settings.PENDING_NOTIFICATIONS_SWEEP_INTERVAL)
+        if event.oldest <= now - wait:
+            logger.warning(f"Flushing the stale notifications of subscription {event.id}")
+            flush_notifications.delay(event.id)
@@ -1,20 +1,41 @@
+import io
+import hmac
 import json
+import time
 import mock
+import hashlib
+import requests
+import threading
 import responses
+from datetime import date, timedelta
+from decimal import Decimal
+from socketserver import ThreadingMixIn
+from http.server import BaseHTTPRequestHandler, HTTPServer
 
-from django.test import TestCase
+from freezegun import freeze_time
+from django.db import IntegrityError
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from django.core.management import call_command
 from django.contrib.auth.models import Group
 
 from profiles.fixtures_factory import (
     UserFactory,
     DeveloperProfileFactory,
 )
-from eventful.tasks import notify
-from eventful.models import Event
+from eventful import delivery, events
+from eventful.async_delivery import deliver_many
+from eventful.tasks import notify, notify_many, flush_stale_notifications
+from eventful.models import Event, FailedDelivery, PendingNotification, OutboxEvent
+from eventful.subscriptions import SubscriptionCache, subscriptions
 
 APPLY_ASYNC = mock.Mock()
 
 
+def serialized(payload):
+    return delivery.serialize('SHIPMENT_STATE_CHANGED', payload)
+
+
 class TestEventAPI(TestCase):
     fixtures = ['auth.json']
 
@@ -61,14 +82,65 @@ class TestEventAPI(TestCase):
         )
 
         self.assertEquals(201, response.status_code)
+        subscription = response.json()
+        self.assertEquals(64, len(subscription.pop('secret')))
         self.assertEquals(
             {
                 'id': 1,
                 'event_name': 'SHIPMENT_STATE_CHANGED',
                 'webhook': 'http://www.google.com',
                 'max_retry': 1,
-                'headers': '{}'
-            }, response.json())
+                'headers': {},
+                'batch_window': 0.0,
+                'batch_size': 100
+            }, subscription)
+
+    def test_developer_can_subscribe_many_webhooks_to_an_event(self):
+        access_token = self._get_access_token(self.developer1.username, "dev")
+
+        statuses = []
+        for webhook in ("http://test1.com", "http://test2.com", "http://test1.com"):
+            response = self.client.post(
+                '/api/v1/events/',
+                data=json.dumps({"webhook": webhook, "event_name": "SHIPMENT_STATE_CHANGED"}),
+                content_type='application/json',
+                HTTP_AUTHORIZATION=f"Bearer {access_token}",
+            )
+            statuses.append(response.status_code)
+
+        self.assertEquals([201, 201, 400], statuses)
+        self.assertEquals({"non_field_errors": ["This webhook is already subscribed to this event"]},
+                          response.json())
+        events = Event.objects.filter(user=self.developer1).order_by('id')
+        self.assertEquals(["http://test1.com", "http://test2.com"], [event.webhook for event in events])
+
+    def test_developer_can_list_event_types(self):
+        access_token = self._get_access_token(self.developer1.username, "dev")
+
+        response = self.client.get('/api/v1/events/types/', HTTP_AUTHORIZATION=f"Bearer {access_token}")
+
+        self.assertEquals(200, response.status_code)
+        self.assertEquals(["SHIPMENT_STATE_CHANGED", "SHIPMENT_SCHEDULED", "SHIPMENT_DRIVER_ASSIGNED",
+                           "SHIPMENT_DOCUMENTS_ATTACHED", "SHIPMENT_ETA_CHANGED"],
+                          [event_type["name"] for event_type in response.json()])
+        self.assertIn("driver_id", response.json()[2]["fields"])
+
+    def test_subscription_headers_are_validated(self):
+        access_token = self._get_access_token(self.developer1.username, "dev")
+
+        # a json string is still accepted, the headers are stored as an object
+        for headers, status in (('{"Auth": "123"}', 201), ({"Auth": 123}, 400), ("not json", 400),
+                                (["Auth"], 400), ({"Auth": "123"}, 201)):
+            Event.objects.all().delete()
+            response = self.client.post(
+                '/api/v1/events/',
+                data=json.dumps({"webhook": "http://www.google.com", "headers": headers}),
+                content_type='application/json',
+                HTTP_AUTHORIZATION=f"Bearer {access_token}",
+            )
+            self.assertEquals(status, response.status_code, headers)
+
+        self.assertEquals({"Auth": "123"}, Event.objects.get().headers)
 
     def test_developer_can_get_subscriptions(self):
 
@@ -87,23 +159,299 @@ class TestEventAPI(TestCase):
         self.assertEquals(200, response.status_code)
         self.assertEquals(1, len(response.json()))
 
+    def _fail_delivery(self, event, payload):
+        return FailedDelivery.objects.create(subscription=event,
+                                             event_name=event.event_name,
+                                             webhook=event.webhook,
+                                             payload=payload,
+                                             error="HTTPError('503 Server Error')",
+                                             attempts=2)
+
+    def test_developer_can_list_failed_deliveries(self):
+        failed = self._fail_delivery(Event.objects.create(user=self.developer1, webhook="http://test.com"),
+                                     {"test": "test1"})
+        self._fail_delivery(Event.objects.create(user=self.developer2, webhook="http://test.com"), {})
+        access_token = self._get_access_token(self.developer1.username, "dev")
+
+        response = self.client.get(
+            '/api/v1/failed_deliveries/',
+            content_type='application/json',
+            HTTP_AUTHORIZATION=f"Bearer {access_token}",
+        )
+
+        self.assertEquals(200, response.status_code)
+        self.assertEquals([failed.id], [delivery['id'] for delivery in response.json()])
+        self.assertEquals({"test": "test1"}, response.json()[0]['payload'])
+
+    @mock.patch("eventful.models.group")
+    def test_developer_can_redrive_failed_deliveries(self, group_mock):
+        event = Event.objects.create(user=self.developer1, webhook="http://old.com", max_retry=2)
+        first = self._fail_delivery(event, {"test": "test1"})
+        self._fail_delivery(event, {"test": "test2"})
+        other = self._fail_delivery(Event.objects.create(user=self.developer2, webhook="http://test.com"), {})
+        # the subscriber fixed its webhook meanwhile
+        Event.objects.filter(id=event.id).update(webhook="http://new.com")
+        access_token = self._get_access_token(self.developer1.username, "dev")
+
+        response = self.client.post(
+            '/api/v1/failed_deliveries/redrive/',
+            data=json.dumps({"ids": [first.id, other.id]}),
+            content_type='application/json',
+            HTTP_AUTHORIZATION=f"Bearer {access_token}",
+        )
+
+        self.assertEquals({"success": True, "redriven": 1}, response.json())
+        signatures = group_mock.call_args[0][0]
+        event.refresh_from_db()
+        self.assertEquals([event.delivery_args("SHIPMENT_STATE_CHANGED", {"test": "test1"})],
+                          [tuple(signature.args) for signature in signatures])
+        self.assertEquals("http://new.com", signatures[0].args[0])
+
+        response = self.client.post(
+            '/api/v1/failed_deliveries/redrive/',
+            content_type='application/json',
+            HTTP_AUTHORIZATION=f"Bearer {access_token}",
+        )
+
+        self.assertEquals({"success": True, "redriven": 1}, response.json())
+        self.assertEquals([other.id], [failed.id for failed in FailedDelivery.objects.all()])
+
+    @mock.patch("eventful.models.group")
+    def test_failed_deliveries_are_kept_when_redrive_fails(self, group_mock):
+        group_mock.return_value.apply_async.side_effect = ConnectionError("broker is down")
+        event = Event.objects.create(user=self.developer1, webhook="http://test.com")
+        failed = self._fail_delivery(event, {})
+
+        with self.assertRaises(ConnectionError):
+            FailedDelivery.objects.all().redrive()
+
+        self.assertEquals([failed.id], [delivery.id for delivery in FailedDelivery.objects.all()])
+
+    @override_settings(WEBHOOK_BATCH_SIZE=2, WEBHOOK_REDRIVE_INTERVAL=5)
+    @mock.patch("eventful.models.group")
+    def test_redriven_deliveries_are_spread_in_batches(self, group_mock):
+        event = Event.objects.create(user=self.developer1, webhook="http://test.com")
+        for i in range(5):
+            self._fail_delivery(event, {"test": i})
+
+        self.assertEquals(5, FailedDelivery.objects.all().redrive())
+
+        signatures = group_mock.call_args[0][0]
+        countdowns = [signature.options.get('countdown') for signature in signatures]
+        self.assertEquals([None, None, 5, 5, 10], countdowns)
+
 
 class TestEventDispatch(TestCase):
     """Testing event notification dispatching"""
+    def setUp(self):
+        subscriptions.clear()
+
+    @mock.patch("eventful.models.group")
+    def test_relayed_event_is_sent_to_the_subscription(self, group_mock):
+        user = UserFactory()
+        event = Event.objects.create(user=user, webhook="http://test.com", headers={"Auth": "123"})
+        Event.publish(event.event_name, user.id, shipment_payload("1"))
+        # the payload as it is read back from the outbox
+        payload = OutboxEvent.objects.get().payload
+        OutboxEvent.objects.relay()
+        group_mock.return_value.apply_async.assert_called_once()
+        self.assertEquals([event.delivery_args(event.event_name, payload)],
+                          [tuple(signature.args) for signature in group_mock.call_args[0][0]])
+
+    def test_event_is_sent_to_all_the_subscriptions(self):
+        user = UserFactory()
+        first = Event.objects.create(user=user, webhook="http://test1.com")
+        second = Event.objects.create(user=user, webhook="http://test2.com", headers={"Auth": "123"})
+        Event.objects.create(user=UserFactory(), webhook="http://test3.com")
+
+        with self.assertNumQueries(1):
+            signatures = Event.prepare_dispatch(first.event_name, [(user.id, {"test": "test1"})])
+
+        self.assertEquals([
+            first.delivery_args(first.event_name, {'test': 'test1'}),
+            second.delivery_args(second.event_name, {'test': 'test1'}),
+        ], [tuple(signature.args) for signature in signatures])
+
+    def test_subscriptions_are_cached(self):
+        user = UserFactory()
+        other = UserFactory()
+        event = Event.objects.create(user=user, webhook="http://test.com", headers={"Auth": "123"})
+        Event.prepare_dispatch(event.event_name, [
+            (user.id, {"test": "test1"}),
+            (other.id, {"test": "test1"}),
+        ])
+
+        with self.assertNumQueries(0):
+            signatures = Event.prepare_dispatch(event.event_name, [
+                (user.id, {"test": "test2"}),
+                (other.id, {"test": "test3"}),
+            ])
+        self.assertEquals(1, len(signatures))
+
+        # saving the subscription drops it from the cache
+        event.webhook = "http://test2.com"
+        event.save()
+        signatures = Event.prepare_dispatch(event.event_name, [(user.id, {"test": "test4"})])
+        self.assertEquals('http://test2.com', signatures[0].args[0])
+
+        event.delete()
+        self.assertEquals([], Event.prepare_dispatch(event.event_name, [(user.id, {"test": "test5"})]))
+
+    def test_subscription_changes_are_seen_by_other_processes(self):
+        other_process = SubscriptionCache()
+        user = UserFactory()
+        event = Event.objects.create(user=user, webhook="http://test.com")
+        self.assertEquals(["http://test.com"],
+                          [event.webhook for event in other_process.get(user.id, event.event_name)])
+
+        event.webhook = "http://test2.com"
+        event.save()
+
+        with self.assertNumQueries(1):
+            self.assertEquals(["http://test2.com"],
+                              [event.webhook for event in other_process.get(user.id, event.event_name)])
+
+    def test_events_of_many_users_are_prepared_together(self):
+        user1 = UserFactory()
+        user2 = UserFactory()
+        user3 = UserFactory()
+        event1 = Event.objects.create(user=user1, webhook="http://test1.com", headers={"Auth": "123"})
+        event2 = Event.objects.create(user=user2, webhook="http://test2.com", max_retry=3)
+
+        with self.assertNumQueries(1):
+            signatures = Event.prepare_dispatch("SHIPMENT_STATE_CHANGED", [
+                (user1.id, {"test": "test1"}),
+                (user2.id, {"test": "test2"}),
+                (user3.id, {"test": "test3"}),
+                (user1.id, {"test": "test4"}),
+            ])
+
+        event_name = 'SHIPMENT_STATE_CHANGED'
+        self.assertEquals([
+            event1.delivery_args(event_name, {'test': 'test1'}),
+            event2.delivery_args(event_name, {'test': 'test2'}),
+            event1.delivery_args(event_name, {'test': 'test4'}),
+        ], [tuple(signature.args) for signature in signatures])
+
+    @override_settings(WEBHOOK_DISPATCHER="asyncio", WEBHOOK_BATCH_SIZE=2)
+    @mock.patch("eventful.models.group")
+    def test_relayed_events_are_sent_in_batches(self, group_mock):
+        user1 = UserFactory()
+        user2 = UserFactory()
+        event1 = Event.objects.create(user=user1, webhook="http://test1.com", headers={"Auth": "123"})
+        event2 = Event.objects.create(user=user2, webhook="http://test2.com", max_retry=3)
+
+        Event.publish_many("SHIPMENT_STATE_CHANGED", [
+            (user1.id, shipment_payload("1")),
+            (user2.id, shipment_payload("2")),
+            (user1.id, shipment_payload("3")),
+        ])
+        payloads = [event.payload for event in OutboxEvent.objects.all()]
+        OutboxEvent.objects.relay()
+
+        group_mock.return_value.apply_async.assert_called_once()
+        signatures = group_mock.call_args[0][0]
+        self.assertEquals(['eventful.tasks.notify_many'] * 2, [signature.task for signature in signatures])
+        event_name = 'SHIPMENT_STATE_CHANGED'
+        self.assertEquals([
+            [
+                event1.delivery_args(event_name, payloads[0]),
+                event2.delivery_args(event_name, payloads[1]),
+            ],
+            [event1.delivery_args(event_name, payloads[2])],
+        ], [signature.args[0] for signature in signatures])
+
+    @mock.patch("eventful.models.group")
+    def test_batching_subscription_buffers_events(self, group_mock):
+        user = UserFactory()
+        event = Event.objects.create(user=user, webhook="http://test.com", batch_window=5)
+
+        Event.publish(event.event_name, user.id, shipment_payload("1"))
+        OutboxEvent.objects.relay()
+        Event.publish(event.event_name, user.id, shipment_payload("2", scheduled_at=date(2020, 9, 1)))
+        OutboxEvent.objects.relay()
+
+        # the window starts with the first event, nothing is sent until it is over
+        group_mock.assert_called_once()
+        [flush] = group_mock.call_args[0][0]
+        self.assertEquals(('eventful.tasks.flush_notifications', (event.id, ), 5),
+                          (flush.task, tuple(flush.args), flush.options['countdown']))
+        self.assertEquals(["1", "2"], [pending.key for pending in PendingNotification.objects.all()])
+        self.assertEquals("2020-09-01", PendingNotification.objects.last().payload["scheduled_at"])
+
+    @mock.patch("eventful.models.group")
+    def test_full_batch_is_flushed_right_away(self, group_mock):
+        user = UserFactory()
+        event = Event.objects.create(user=user, webhook="http://test.com", batch_window=5, batch_size=3)
+
+        Event.publish_many(event.event_name, [(user.id, shipment_payload(str(i))) for i in range(3)])
+        OutboxEvent.objects.relay()
+
+        [flush] = group_mock.call_args[0][0]
+        self.assertEquals(((event.id, ), {}), (tuple(flush.args), flush.options))
+
+    @mock.patch("eventful.models.flush_notifications.apply_async")
     @mock.patch("eventful.models.notify.apply_async")
-    def test_event_dispatch(self, notify_mock):
+    def test_flush_sends_coalesced_batch(self, notify_mock, flush_mock):
         user = UserFactory()
-        event = Event.objects.create(user=user, webhook="http://test.com", headers='{"Auth": "123"}')
-        Event.dispatch(event.event_name, user.id, {"test": "test1"})
-        notify_mock.assert_called_with(
-            ('http://test.com', 'SHIPMENT_STATE_CHANGED', {
-                'test': 'test1'
-            }, {
-                "Auth": "123"
-            }),
-            retry=True,
-            retry_policy={'max_retries': 1},
-        )
+        event = Event.objects.create(user=user, webhook="http://test.com", batch_window=5, batch_size=3)
+        for payload in ({"tracking_id": "1", "state": "NEW"}, {"tracking_id": "2", "state": "NEW"},
+                        {"tracking_id": "1", "state": "PICKED_UP"}, {"tracking_id": "3", "state": "NEW"}):
+            PendingNotification.objects.create(subscription=event, key=payload["tracking_id"],
+                                               payload=payload)
+
+        self.assertEquals(2, event.flush_pending())
+
+        notify_mock.assert_called_once()
+        self.assertEquals([
+            {"tracking_id": "2", "state": "NEW"},
+            {"tracking_id": "1", "state": "PICKED_UP"},
+        ], delivery.deserialize(notify_mock.call_args[0][0][2]))
+        # the rest is sent with the next batch
+        flush_mock.assert_called_once_with((event.id, ), countdown=5)
+        self.assertEquals(["3"], [pending.key for pending in PendingNotification.objects.all()])
+        self.assertEquals(1, event.flush_pending())
+        self.assertEquals(0, event.flush_pending())
+
+    @mock.patch("eventful.models.notify.apply_async", side_effect=ConnectionError("broker is down"))
+    def test_batch_is_kept_when_flush_fails(self, notify_mock):
+        event = Event.objects.create(user=UserFactory(), webhook="http://test.com", batch_window=5)
+        PendingNotification.objects.create(subscription=event, key="1", payload={"tracking_id": "1"})
+
+        with self.assertRaises(ConnectionError):
+            event.flush_pending()
+
+        self.assertEquals(["1"], [pending.key for pending in PendingNotification.objects.all()])
+
+    @mock.patch("eventful.tasks.flush_notifications.delay")
+    def test_stale_batches_are_flushed(self, flush_mock):
+        stale = Event.objects.create(user=UserFactory(), webhook="http://test1.com", batch_window=5)
+        waiting = Event.objects.create(user=UserFactory(), webhook="http://test2.com", batch_window=300)
+        Event.objects.create(user=UserFactory(), webhook="http://test3.com", batch_window=5)
+        with freeze_time(timezone.now() - timedelta(seconds=100)):
+            PendingNotification.objects.create(subscription=stale, key="1", payload={"tracking_id": "1"})
+            PendingNotification.objects.create(subscription=waiting, key="2", payload={"tracking_id": "2"})
+        PendingNotification.objects.create(subscription=stale, key="3", payload={"tracking_id": "3"})
+
+        flush_stale_notifications()
+
+        flush_mock.assert_called_once_with(stale.id)
+
+    def test_deliveries_are_serialized_and_signed_once(self):
+        event = Event.objects.create(user=UserFactory(), webhook="http://test.com", headers={"Auth": "123"})
+        payload = {"tracking_id": "1", "lat": Decimal("30.04440000"), "scheduled_at": date(2020, 9, 1)}
+
+        webhook, event_name, body, headers, _, _ = event.delivery_args(event.event_name, payload)
+
+        self.assertEquals(
+            '{"event":"SHIPMENT_STATE_CHANGED","payload":'
+            '{"tracking_id":"1","lat":"30.04440000","scheduled_at":"2020-09-01"}}', body)
+        signature = hmac.new(event.secret.encode(), body.encode(), hashlib.sha256).hexdigest()
+        self.assertEquals({
+            "Content-Type": "application/json",
+            "Auth": "123",
+            "X-Webhook-Signature": f"sha256={signature}",
+        }, headers)
 
     @responses.activate
     def test_notify_event(self):
@@ -111,7 +459,8 @@ class TestEventDispatch(TestCase):
             responses.POST,
             "http://test.com",
         )
-        notify('http://test.com', 'SHIPMENT_STATE_CHANGED', {'test': 'test1'}, {"Auth": "123"})
+        notify('http://test.com', 'SHIPMENT_STATE_CHANGED', serialized({'test': 'test1'}),
+               {"Auth": "123"})
 
         self.assertEquals("123", responses.calls[0].request.headers['Auth'])
         self.assertEquals({
@@ -120,3 +469,277 @@ class TestEventDispatch(TestCase):
                 "test": "test1"
             }
         }, json.loads(responses.calls[0].request.body))
+
+    @responses.activate
+    def test_failed_notification_is_retried_then_dead_lettered(self):
+        event = Event.objects.create(user=UserFactory(), webhook="http://test.com", max_retry=2)
+        responses.add(responses.POST, "http://test.com", status=503)
+
+        with self.assertLogs('eventful.tasks', level='ERROR'):
+            notify.apply(event.delivery_args(event.event_name, {"test": "test1"}))
+
+        self.assertEquals(3, len(responses.calls))
+        failed = FailedDelivery.objects.get()
+        self.assertEquals((event, "http://test.com", {"test": "test1"}, 3),
+                          (failed.subscription, failed.webhook, failed.payload, failed.attempts))
+        self.assertIn("503", failed.error)
+
+    @responses.activate
+    def test_unreachable_webhook_is_retried(self):
+        event = Event.objects.create(user=UserFactory(), webhook="http://test.com", max_retry=1)
+        responses.add(responses.POST, "http://test.com", body=requests.exceptions.ConnectionError())
+        responses.add(responses.POST, "http://test.com")
+
+        notify.apply(event.delivery_args(event.event_name, {"test": "test1"}))
+
+        self.assertEquals(2, len(responses.calls))
+        self.assertFalse(FailedDelivery.objects.exists())
+
+    @responses.activate
+    def test_rejected_notification_is_not_retried(self):
+        event = Event.objects.create(user=UserFactory(), webhook="http://test.com", max_retry=3)
+        responses.add(responses.POST, "http://test.com", status=404)
+
+        with self.assertLogs('eventful.tasks', level='ERROR'):
+            notify.apply(event.delivery_args(event.event_name, {"test": "test1"}))
+
+        self.assertEquals(1, len(responses.calls))
+        self.assertEquals(1, FailedDelivery.objects.get().attempts)
+
+    def test_retries_back_off_with_jitter(self):
+        with mock.patch("eventful.delivery.random.uniform", side_effect=lambda low, high: high):
+            self.assertEquals([2, 4, 8, 600], [delivery.backoff(retries) for retries in (0, 1, 2, 20)])
+
+        self.assertTrue(all(0 <= delivery.backoff(3) <= 16 for _ in range(100)))
+
+
+def shipment_payload(tracking_id, **values):
+    return {**dict.fromkeys(events.SHIPMENT_FIELDS), "tracking_id": tracking_id, **values}
+
+
+class TestOutbox(TestCase):
+    """Testing the events saved to the outbox and relayed to the workers"""
+    def setUp(self):
+        subscriptions.clear()
+        self.user = UserFactory()
+        self.event = Event.objects.create(user=self.user, webhook="http://test.com")
+
+    def test_publish_saves_events_to_the_outbox(self):
+        other = UserFactory()
+
+        with self.assertNumQueries(1):
+            Event.publish_many(self.event.event_name, [
+                (self.user.id, shipment_payload("1", scheduled_at=date(2020, 9, 1))),
+                (other.id, shipment_payload("2")),
+                (None, shipment_payload("3")),
+            ])
+
+        # the subscriptions are checked by the relay
+        self.assertEquals([
+            (self.user.id, shipment_payload("1", scheduled_at="2020-09-01")),
+            (other.id, shipment_payload("2")),
+        ], [(event.user_id, event.payload) for event in OutboxEvent.objects.all()])
+
+    def test_publish_checks_the_event_type(self):
+        with self.assertRaisesMessage(ValueError, "Unknown event SHIPMENT_LOST"):
+            Event.publish("SHIPMENT_LOST", self.user.id, shipment_payload("1"))
+        with self.assertRaisesMessage(ValueError, "SHIPMENT_DRIVER_ASSIGNED is missing driver_id"):
+            Event.publish(events.SHIPMENT_DRIVER_ASSIGNED.name, self.user.id, shipment_payload("1"))
+
+        self.assertFalse(OutboxEvent.objects.exists())
+
+    @mock.patch("eventful.models.group")
+    @mock.patch("eventful.models.Event.prepare_dispatch", return_value=[APPLY_ASYNC])
+    def test_relay_dispatches_events_in_batches(self, prepare_dispatch_mock, group_mock):
+        Event.publish_many(self.event.event_name,
+                           [(self.user.id, shipment_payload(str(i))) for i in range(3)])
+
+        self.assertEquals(2, OutboxEvent.objects.relay(batch_size=2))
+        prepare_dispatch_mock.assert_called_once_with(self.event.event_name, [
+            (self.user.id, shipment_payload("0")),
+            (self.user.id, shipment_payload("1")),
+        ])
+        group_mock.assert_called_once_with([APPLY_ASYNC])
+
+        call_command('relay_outbox', '--once', stdout=io.StringIO())
+        self.assertEquals((self.event.event_name, [(self.user.id, shipment_payload("2"))]),
+                          prepare_dispatch_mock.call_args[0])
+        self.assertFalse(OutboxEvent.objects.exists())
+
+    @mock.patch("eventful.models.group")
+    def test_events_stay_in_the_outbox_when_relay_fails(self, group_mock):
+        group_mock.return_value.apply_async.side_effect = ConnectionError("broker is down")
+        batching = Event.objects.create(user=self.user, webhook="http://test2.com", batch_window=5)
+        Event.publish(self.event.event_name, self.user.id, shipment_payload("1"))
+
+        with self.assertRaises(ConnectionError):
+            OutboxEvent.objects.relay()
+        call_command('relay_outbox', '--once', stdout=io.StringIO())
+
+        self.assertEquals(1, OutboxEvent.objects.count())
+        self.assertFalse(batching.pending_notifications.exists())
+
+    @mock.patch("eventful.models.group")
+    @mock.patch("eventful.models.Event.prepare_dispatch", side_effect=IntegrityError("subscription deleted"))
+    def test_nothing_is_sent_when_writing_fails(self, prepare_dispatch_mock, group_mock):
+        Event.publish(self.event.event_name, self.user.id, shipment_payload("1"))
+
+        with self.assertRaises(IntegrityError):
+            OutboxEvent.objects.relay()
+
+        group_mock.assert_not_called()
+        self.assertEquals(1, OutboxEvent.objects.count())
+
+    @override_settings(OUTBOX_POLL_INTERVAL=0.5, OUTBOX_MAX_BACKOFF=1.5)
+    @mock.patch("eventful.management.commands.relay_outbox.time.sleep",
+                side_effect=[None, None, None, None, KeyboardInterrupt])
+    @mock.patch("eventful.models.OutboxEventQuerySet.relay")
+    def test_relay_backs_off_while_failing(self, relay_mock, sleep_mock):
+        relay_mock.side_effect = [ConnectionError(), ConnectionError(), ConnectionError(), 0,
+                                  ConnectionError()]
+
+        with self.assertRaises(KeyboardInterrupt):
+            call_command('relay_outbox', stdout=io.StringIO())
+
+        self.assertEquals([1.0, 1.5, 1.5, 0.5, 1.0], [call[0][0] for call in sleep_mock.call_args_list])
+
+
+class WebhookServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    """Answer webhooks after `delay` seconds, `/fail` answers 500, the requests are recorded"""
+
+    protocol_version = "HTTP/1.1"
+    lock = threading.Lock()
+    delay = 0
+    bodies = []
+    active = 0
+    max_active = 0
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        cls = type(self)
+        with cls.lock:
+            cls.bodies.append(body)
+            cls.active += 1
+            cls.max_active = max(cls.max_active, cls.active)
+        time.sleep(cls.delay)
+        with cls.lock:
+            cls.active -= 1
+
+        self.send_response(500 if self.path == '/fail' else 200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class TestWebhookDelivery(TestCase):
+    """Testing the pooled webhook http session and the asyncio dispatcher"""
+
+    def setUp(self):
+        delivery._sessions.clear()
+        delivery.metrics.reset()
+        WebhookHandler.delay, WebhookHandler.bodies = 0, []
+        WebhookHandler.active = WebhookHandler.max_active = 0
+
+    def _start_server(self):
+        server = WebhookServer(('127.0.0.1', 0), WebhookHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.addCleanup(lambda: delivery.get_session().close())
+        return f"http://127.0.0.1:{server.server_port}"
+
+    def test_webhooks_reuse_connections(self):
+        webhook = f"{self._start_server()}/hook"
+
+        for i in range(3):
+            notify(webhook, 'SHIPMENT_STATE_CHANGED', serialized({'test': i}), {})
+
+        snapshot = delivery.metrics.snapshot()
+        self.assertEquals((3, 0), (snapshot['deliveries'], snapshot['failures']))
+        self.assertEquals((3, 1, 2),
+                          (snapshot['requests'], snapshot['connections'], snapshot['reused_connections']))
+        self.assertIs(delivery.get_session(), delivery.get_session())
+
+    @override_settings(WEBHOOK_POOL_MAXSIZE=5)
+    def test_notify_many_sends_webhooks_concurrently(self):
+        WebhookHandler.delay = .2
+        url = self._start_server()
+        deliveries = [
+            (f"{url}/hook", 'SHIPMENT_STATE_CHANGED', serialized({'test': i}), {}, 0, None) for i in range(10)
+        ]
+
+        start = time.monotonic()
+        notify_many(deliveries)
+
+        # one after the other it would take 2 seconds
+        self.assertLess(time.monotonic() - start, 1.5)
+        self.assertEquals(5, WebhookHandler.max_active)
+        bodies = [{"event": "SHIPMENT_STATE_CHANGED", "payload": {"test": i}} for i in range(10)]
+        self.assertCountEqual(bodies, WebhookHandler.bodies)
+        self.assertEquals((10, 0), (delivery.metrics.deliveries, delivery.metrics.failures))
+
+    def test_notify_many_logs_failed_webhooks(self):
+        url = self._start_server()
+
+        with self.assertLogs('eventful.tasks', level='ERROR') as logs:
+            errors = deliver_many([
+                (f"{url}/hook", 'SHIPMENT_STATE_CHANGED', serialized({'test': 1}), {}),
+                (f"{url}/fail", 'SHIPMENT_STATE_CHANGED', serialized({'test': 2}), {}),
+            ])
+            notify_many([(f"{url}/fail", 'SHIPMENT_STATE_CHANGED', serialized({'test': 3}), {}, 0, None)])
+
+        self.assertIsNone(errors[0])
+        self.assertEquals(500, errors[1].status)
+        self.assertEquals(1, len(logs.output))
+        self.assertIn(f"{url}/fail", logs.output[0])
+
+    @mock.patch("eventful.tasks.notify_many.apply_async")
+    def test_notify_many_retries_failed_webhooks_together(self, retry_mock):
+        event = Event.objects.create(user=UserFactory(), webhook=f"{self._start_server()}/fail", max_retry=1)
+        deliveries = [
+            event.delivery_args(event.event_name, {"test": 1}),
+            (event.webhook.replace("/fail", "/hook"), event.event_name, serialized({"test": 2}), {}, 1,
+             event.id),
+            event.delivery_args(event.event_name, {"test": 3}),
+        ]
+
+        notify_many(deliveries)
+
+        self.assertEquals(((([deliveries[0], deliveries[2]], 1), ), ), retry_mock.call_args[:1])
+        self.assertFalse(FailedDelivery.objects.exists())
+
+        with self.assertLogs('eventful.tasks', level='ERROR'):
+            notify_many([deliveries[0], deliveries[2]], 1)
+
+        retry_mock.assert_called_once()
+        failed = FailedDelivery.objects.all()
+        self.assertEquals([{"test": 1}, {"test": 3}], [failed_delivery.payload for failed_delivery in failed])
+        self.assertEquals({2}, {failed_delivery.attempts for failed_delivery in failed})
+
+    @mock.patch("eventful.delivery.get_session")
+    def test_webhooks_are_sent_with_timeouts(self, session_mock):
+        notify('http://test.com', 'SHIPMENT_STATE_CHANGED', serialized({'test': 'test1'}),
+               {"Auth": "123"})
+
+        session_mock.return_value.post.assert_called_once_with(
+            'http://test.com',
+            data=b'{"event":"SHIPMENT_STATE_CHANGED","payload":{"test":"test1"}}',
+            headers={"Auth": "123"},
+            timeout=(3.05, 10),
+        )
+
+    @responses.activate
+    def test_slow_webhooks_are_logged_as_failures(self):
+        responses.add(responses.POST, "http://test.com", body=requests.exceptions.ReadTimeout())
+
+        with self.assertLogs('eventful.tasks', level='ERROR'):
+            notify('http://test.com', 'SHIPMENT_STATE_CHANGED', serialized({'test': 'test1'}), {})
+
+        snapshot = delivery.metrics.snapshot()
+        self.assertEquals((1, 1), (snapshot['deliveries'], snapshot['failures']))
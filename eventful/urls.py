@@ -1,5 +1,6 @@
 from rest_framework import routers
-from .views import EventResource
+from .views import EventResource, FailedDeliveryResource
 
 event_router = routers.SimpleRouter()
 event_router.register(r'events', EventResource)
+event_router.register(r'failed_deliveries', FailedDeliveryResource)
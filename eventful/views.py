@@ -1,10 +1,12 @@
-
 import logging
 
-from rest_framework import viewsets
+from rest_framework import mixins, viewsets, status
+from rest_framework.decorators import action
+from rest_framework.response import Response
 from shipment.custom_permissions import CanSubscribeWebhook
-from eventful.serializers import EventSerializer
-from eventful.models import Event
+from eventful.serializers import EventSerializer, FailedDeliverySerializer
+from eventful import events
+from eventful.models import Event, FailedDelivery
 
 logger = logging.getLogger(__name__)
 
@@ -18,3 +20,50 @@ class EventResource(viewsets.ModelViewSet):
     def get_queryset(self):
         user = self.request.user
         return Event.objects.all() if user.is_staff else Event.objects.filter(user=user)
+
+    @action(detail=False, methods=['get'])
+    def types(self, request):
+        """List the events that can be subscribed to, with the fields of their payloads"""
+
+        return Response([{
+            "name": event_type.name,
+            "description": event_type.description,
+            "fields": event_type.fields,
+        } for event_type in events.REGISTRY.values()], status=status.HTTP_200_OK)
+
+
+class FailedDeliveryResource(mixins.ListModelMixin,
+                             mixins.RetrieveModelMixin,
+                             mixins.DestroyModelMixin,
+                             viewsets.GenericViewSet):
+
+    permission_classes = (CanSubscribeWebhook, )
+    serializer_class = FailedDeliverySerializer
+    queryset = FailedDelivery.objects.all()
+
+    def get_queryset(self):
+        user = self.request.user
+        deliveries = FailedDelivery.objects.all()
+        return deliveries if user.is_staff else deliveries.filter(subscription__user=user)
+
+    @action(detail=False, methods=['post'])
+    def redrive(self, request):
+        """Send the given failed deliveries again, all of them if no ids are given"""
+
+        try:
+            ids = request.data.get("ids")
+            assert ids is None or isinstance(ids, list), "ids should be a list"
+
+            deliveries = self.get_queryset()
+            if ids is not None:
+                deliveries = deliveries.filter(id__in=ids)
+
+            return Response({"success": True, "redriven": deliveries.redrive()}, status=status.HTTP_200_OK)
+
+        except AssertionError as e:
+            return Response({"success": False, "error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        except Exception as e:
+            logger.exception(f"Error {e} while redriving failed deliveries")
+            return Response({"success": False, "error": "error happened please try again later"},
+                            status=status.HTTP_500_INTERNAL_SERVER_ERROR)
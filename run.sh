@@ -23,4 +23,22 @@ then
     echo
     celery worker -A shipping --loglevel=INFO
 
+elif [ "$1" = "beat" ]
+then
+
+    echo "======================"
+    echo "Running celery beat"
+    echo "======================"
+    echo
+    celery beat -A shipping --loglevel=INFO
+
+elif [ "$1" = "relay" ]
+then
+
+    echo "======================"
+    echo "Running outbox relay"
+    echo "======================"
+    echo
+    python manage.py relay_outbox
+
 fi
\ No newline at end of file
@@ -0,0 +1,127 @@
+import numpy as np
+from django.conf import settings
+
+HAVERSINE = 'haversine'
+GEODESIC = 'geodesic'
+
+EARTH_RADIUS_KM = 6371.0088
+
+# WGS-84 ellipsoid, the same one geopy uses by default
+WGS84_A = 6378.137
+WGS84_F = 1 / 298.257223563
+WGS84_B = (1 - WGS84_F) * WGS84_A
+
+
+def _radians(degrees):
+    return np.radians(np.asarray(degrees, dtype=float))
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """
+    Calculate the great circle distance between points on a spherical earth.
+    It is the fastest method, and is off by up to 0.5% from the geodesic distance.
+
+    All the arguments are in degrees and can be scalars or arrays, they are broadcast together.
+
+    Returns:
+        ndarray: the distances in (KM).
+    """
+
+    lat1, lon1, lat2, lon2 = map(_radians, (lat1, lon1, lat2, lon2))
+
+    a = np.sin((lat2 - lat1) / 2)**2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2)**2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+def geodesic(lat1, lon1, lat2, lon2, max_iterations=200, tolerance=1e-12):
+    """
+    Calculate the distance between points on the WGS-84 ellipsoid using Vincenty's inverse formula.
+    It agrees with geopy's geodesic distance to well under a meter, the iterations run on whole arrays.
+    Nearly antipodal points may not converge, the last iteration is used for them.
+
+    All the arguments are in degrees and can be scalars or arrays, they are broadcast together.
+
+    Returns:
+        ndarray: the distances in (KM).
+    """
+
+    lat1, lon1, lat2, lon2 = map(_radians, (lat1, lon1, lat2, lon2))
+    f = WGS84_F
+
+    L = lon2 - lon1
+    U1 = np.arctan((1 - f) * np.tan(lat1))
+    U2 = np.arctan((1 - f) * np.tan(lat2))
+    sin_u1, cos_u1 = np.sin(U1), np.cos(U1)
+    sin_u2, cos_u2 = np.sin(U2), np.cos(U2)
+
+    lam = L
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for _ in range(max_iterations):
+            sin_lam, cos_lam = np.sin(lam), np.cos(lam)
+            sin_sigma = np.sqrt((cos_u2 * sin_lam)**2 + (cos_u1 * sin_u2 - sin_u1 * cos_u2 * cos_lam)**2)
+            cos_sigma = sin_u1 * sin_u2 + cos_u1 * cos_u2 * cos_lam
+            sigma = np.arctan2(sin_sigma, cos_sigma)
+
+            sin_alpha = np.where(sin_sigma == 0, 0, cos_u1 * cos_u2 * sin_lam / sin_sigma)
+            cos2_alpha = 1 - sin_alpha**2
+            # equatorial lines have cos2_alpha == 0
+            cos_2sigma_m = np.where(cos2_alpha == 0, 0, cos_sigma - 2 * sin_u1 * sin_u2 / cos2_alpha)
+
+            C = f / 16 * cos2_alpha * (4 + f * (4 - 3 * cos2_alpha))
+            previous_lam = lam
+            lam = L + (1 - C) * f * sin_alpha * (
+                sigma + C * sin_sigma * (cos_2sigma_m + C * cos_sigma * (-1 + 2 * cos_2sigma_m**2)))
+
+            if np.all(np.abs(lam - previous_lam) < tolerance):
+                break
+
+    u2 = cos2_alpha * (WGS84_A**2 - WGS84_B**2) / WGS84_B**2
+    A = 1 + u2 / 16384 * (4096 + u2 * (-768 + u2 * (320 - 175 * u2)))
+    B = u2 / 1024 * (256 + u2 * (-128 + u2 * (74 - 47 * u2)))
+    correction = cos_sigma * (2 * cos_2sigma_m**2 - 1)
+    correction -= B / 6 * cos_2sigma_m * (4 * sin_sigma**2 - 3) * (4 * cos_2sigma_m**2 - 3)
+    delta_sigma = B * sin_sigma * (cos_2sigma_m + B / 4 * correction)
+
+    return WGS84_B * A * (sigma - delta_sigma)
+
+
+METHODS = {
+    HAVERSINE: haversine,
+    GEODESIC: geodesic,
+}
+
+
+def distance(lat1, lon1, lat2, lon2, method=None):
+    """
+    Calculate the distance between points with the given method.
+
+    Args:
+        method (str): `geodesic` (accurate) or `haversine` (faster), defaults to `settings.DISTANCE_METHOD`.
+
+    Returns:
+        ndarray: the distances in (KM).
+
+    Raises:
+        ValueError: if the method is not known.
+    """
+
+    method = method or settings.DISTANCE_METHOD
+    if method not in METHODS:
+        raise ValueError(f"Unknown distance method {method}, use one of {', '.join(METHODS)}")
+    return METHODS[method](lat1, lon1, lat2, lon2)
+
+
+def distance_from_store(lats, lons, method=None):
+    """
+    Calculate the distances between the shipping store and the given destinations.
+
+    Args:
+        lats: The latitudes of the destinations.
+        lons: The longitudes of the destinations.
+        method (str): `geodesic` or `haversine`, defaults to `settings.DISTANCE_METHOD`.
+
+    Returns:
+        ndarray: the distances in (KM).
+    """
+
+    return distance(settings.STORE_LAT, settings.STORE_LON, lats, lons, method)
@@ -1,6 +1,14 @@
+import os
+import time
 import pickle
+import hashlib
+import logging
+import threading
+from collections import namedtuple
+
 import numpy as np
 import pandas as pd
+from django.conf import settings
 
 from sklearn.datasets import make_regression
 from sklearn.model_selection import train_test_split
@@ -8,8 +16,12 @@ from sklearn.linear_model import LinearRegression
 
 np.random.seed(0)
 
+logger = logging.getLogger(__name__)
+
 FILE_NAME = 'finalized_model.sav'
 
+LoadedModel = namedtuple('LoadedModel', ['model', 'version', 'mtime', 'size'])
+
 
 def generate_random_dataset(n_samples):
     X, y = make_regression(n_samples=n_samples, n_features=2, n_informative=2, noise=80, random_state=0)
@@ -30,9 +42,123 @@ def create_save_model():
     X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=.2)
     reg = LinearRegression()
     reg.fit(X_train, y_train)
-    pickle.dump(reg, open(FILE_NAME, 'wb'))
+
+    # write next to the live file then rename, so readers never see a half written model
+    tmp_name = f"{FILE_NAME}.tmp"
+    with open(tmp_name, 'wb') as f:
+        pickle.dump(reg, f)
+    os.replace(tmp_name, FILE_NAME)
+
+
+class ModelRegistry:
+    """
+    Process wide holder of the delivery estimation model.
+
+    The model is unpickled once and kept in memory, the file is stat'ed at most every
+    `check_interval` seconds, `settings.ESTIMATION_MODEL_CHECK_INTERVAL` by default,
+    and reloaded only when its content checksum changes.
+    The loaded model is swapped in as a single immutable `LoadedModel`, so a caller always
+    predicts with the model and version it got from `get()` even if a reload happens meanwhile.
+    """
+
+    def __init__(self, file_name, check_interval=None):
+        self.file_name = file_name
+        self.check_interval = check_interval
+        self._current = None
+        self._next_check = 0
+        self._lock = threading.Lock()
+
+    def get(self):
+        """
+        Return the current model, reloading it if the file on disk has changed.
+
+        Returns:
+            LoadedModel: the model with its version (the checksum of the model file).
+        """
+
+        current = self._current
+        if current is not None and time.monotonic() < self._next_check:
+            return current
+
+        with self._lock:
+            if self._current is not None and time.monotonic() < self._next_check:
+                return self._current
+
+            check_interval = self.check_interval
+            if check_interval is None:
+                check_interval = settings.ESTIMATION_MODEL_CHECK_INTERVAL
+            self._next_check = time.monotonic() + check_interval
+            try:
+                self._current = self._reload_if_changed(self._current)
+            except Exception as e:
+                if self._current is None:
+                    raise
+                # keep serving the model we have rather than failing every estimation
+                logger.exception(f"Error {e} while reloading the estimation model from {self.file_name}")
+
+            return self._current
+
+    @property
+    def version(self):
+        """The version of the model that is currently served."""
+
+        return self.get().version
+
+    def _reload_if_changed(self, current):
+        stat = os.stat(self.file_name)
+        if current is not None and (current.mtime, current.size) == (stat.st_mtime, stat.st_size):
+            return current
+
+        with open(self.file_name, 'rb') as f:
+            content = f.read()
+
+        version = hashlib.sha256(content).hexdigest()[:12]
+        if current is not None and current.version == version:
+            # touched but not changed, no need to unpickle it again
+            return current._replace(mtime=stat.st_mtime, size=stat.st_size)
+
+        model = pickle.loads(content)
+        logger.info(f"Loaded estimation model version {version} from {self.file_name}")
+        return LoadedModel(model=model, version=version, mtime=stat.st_mtime, size=stat.st_size)
+
+
+registry = ModelRegistry(FILE_NAME)
+
+
+def predict_with_version(distance, system_load):
+    """
+    Predict the number of days needed to deliver a shipment.
+
+    Args:
+        distance (float): The distance in (KM) to the destination.
+        system_load (float): The load of the system from 0 to 1.
+
+    Returns:
+        Tuple: the predicted number of days and the version of the model that predicted it.
+    """
+
+    loaded = registry.get()
+    return loaded.model.predict([[distance, system_load]])[0], loaded.version
 
 
 def predict(distance, system_load):
-    model = pickle.load(open(FILE_NAME, 'rb'))
-    return model.predict([[distance, system_load]])[0]
+    return predict_with_version(distance, system_load)[0]
+
+
+def predict_many(distances, system_load):
+    """
+    Predict the number of days needed to deliver many shipments in one call to the model.
+
+    Args:
+        distances (Iterable[float]): The distances in (KM) to the destinations.
+        system_load (float): The load of the system from 0 to 1.
+
+    Returns:
+        Tuple: an array of the predicted number of days and the version of the model that predicted them.
+    """
+
+    distances = np.asarray(distances, dtype=float)
+    features = np.column_stack((distances, np.full(distances.shape, system_load)))
+
+    loaded = registry.get()
+    return loaded.model.predict(features), loaded.version
@@ -0,0 +1,91 @@
+import io
+import csv
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from rest_framework.utils.encoders import JSONEncoder
+
+from .streaming import StreamBuffer, chunked
+
+# Number of shipments read from the database cursor and written out together.
+EXPORT_CHUNK_SIZE = 2000
+
+CSV = 'csv'
+JSONL = 'jsonl'
+PARQUET = 'parquet'
+
+# The exported columns with their parquet types.
+SCHEMA = pa.schema([
+    ('tracking_id', pa.string()),
+    ('title', pa.string()),
+    ('receiver_name', pa.string()),
+    ('receiver_country', pa.string()),
+    ('receiver_address', pa.string()),
+    ('weight', pa.float64()),
+    ('lat', pa.decimal128(12, 8)),
+    ('lon', pa.decimal128(12, 8)),
+    ('state', pa.string()),
+    ('estimated_shipping_date', pa.date32()),
+    ('scheduled_at', pa.date32()),
+    ('driver_id', pa.int64()),
+])
+
+FIELDS = SCHEMA.names
+
+
+def export_rows(shipments, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Read the exported fields of the shipments with a server side cursor, no model is instantiated.
+
+    Args:
+        shipments (QuerySet): The shipments to export.
+        chunk_size (int): The number of rows fetched from the cursor at a time.
+
+    Yields:
+        List[Tuple]: chunks of at most `chunk_size` rows, the values are in the order of `FIELDS`.
+    """
+
+    return chunked(shipments.values_list(*FIELDS).iterator(chunk_size=chunk_size), chunk_size)
+
+
+def write_csv(chunks):
+    """Yield the Bytes of a csv file with a header line, one chunk of rows at a time."""
+
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(FIELDS)
+    for rows in chunks:
+        writer.writerows(rows)
+        yield output.getvalue().encode()
+        output.seek(0)
+        output.truncate()
+    yield output.getvalue().encode()
+
+
+def write_jsonl(chunks):
+    """Yield the Bytes of a json lines file, one object per shipment and one chunk of rows at a time."""
+
+    encoder = JSONEncoder()
+    for rows in chunks:
+        yield "".join(encoder.encode(dict(zip(FIELDS, row))) + "\n" for row in rows).encode()
+
+
+def write_parquet(chunks):
+    """Yield the Bytes of a parquet file, every chunk of rows is written as a row group."""
+
+    output = StreamBuffer()
+    writer = pq.ParquetWriter(output, SCHEMA)
+    for rows in chunks:
+        columns = zip(*rows)
+        writer.write_table(pa.Table.from_arrays(
+            [pa.array(column, type=field.type) for column, field in zip(columns, SCHEMA)], schema=SCHEMA))
+        yield output.pop()
+    writer.close()
+    yield output.pop()
+
+
+WRITERS = {
+    CSV: write_csv,
+    JSONL: write_jsonl,
+    PARQUET: write_parquet,
+}
@@ -0,0 +1,76 @@
+import re
+
+from django.contrib.postgres.search import SearchQuery, SearchVector
+from django.utils.dateparse import parse_date
+from rest_framework.exceptions import ValidationError
+
+# Compiles to the expression of the `shipment_search_idx` index, it has to match it exactly to use the index
+SEARCH_VECTOR = SearchVector('title', 'receiver_name', config='simple')
+
+DATE_FILTERS = {
+    'scheduled_at_after': 'scheduled_at__gte',
+    'scheduled_at_before': 'scheduled_at__lte',
+    'estimated_shipping_date_after': 'estimated_shipping_date__gte',
+    'estimated_shipping_date_before': 'estimated_shipping_date__lte',
+}
+
+
+def _parse_date(name, value):
+    try:
+        date = parse_date(value)
+    except ValueError:
+        date = None
+    if date is None:
+        raise ValidationError({name: "Not a valid date, use YYYY-MM-DD"})
+    return date
+
+
+def search_query(text):
+    """
+    Build a full text query matching every word of `text`, the last letters of a word can be missing.
+
+    Returns:
+        String: the `to_tsquery` expression, empty if there are no words in `text`.
+    """
+
+    return " & ".join(f"{word}:*" for word in re.findall(r'\w+', text.lower()))
+
+
+def filter_shipments(shipments, params):
+    """
+    Filter the shipments by the given query parameters, every filter has an index supporting it.
+
+    Args:
+        shipments (QuerySet): The shipments to filter.
+        params (QueryDict): `state` (comma separated), `receiver_country`, `driver`,
+            `scheduled_at_after`, `scheduled_at_before`, `estimated_shipping_date_after`,
+            `estimated_shipping_date_before` and `search` (words of the title or the receiver name).
+
+    Returns:
+        QuerySet: the filtered shipments.
+
+    Raises:
+        ValidationError: if a filter value is not valid.
+    """
+
+    if params.get('state'):
+        shipments = shipments.filter(state__in=params['state'].upper().split(','))
+
+    if params.get('receiver_country'):
+        shipments = shipments.filter(receiver_country=params['receiver_country'])
+
+    if params.get('driver'):
+        if not params['driver'].isdigit():
+            raise ValidationError({'driver': "Not a valid driver id"})
+        shipments = shipments.filter(driver_id=int(params['driver']))
+
+    for name, lookup in DATE_FILTERS.items():
+        if params.get(name):
+            shipments = shipments.filter(**{lookup: _parse_date(name, params[name])})
+
+    query = search_query(params.get('search', ''))
+    if query:
+        shipments = shipments.annotate(search=SEARCH_VECTOR).filter(
+            search=SearchQuery(query, config='simple', search_type='raw'))
+
+    return shipments
@@ -0,0 +1,101 @@
+import csv
+import json
+
+from .models import Shipment
+from .serializers import ShipmentSerializer
+from .streaming import chunked
+
+# Number of shipments validated and inserted together in one query.
+IMPORT_BATCH_SIZE = 500
+
+CSV = 'csv'
+JSONL = 'jsonl'
+
+FORMATS = {
+    'text/csv': CSV,
+    'application/x-ndjson': JSONL,
+    'application/jsonl': JSONL,
+}
+
+
+def _decode(lines):
+    for line in lines:
+        yield line.decode('utf-8-sig') if isinstance(line, bytes) else line
+
+
+def read_jsonl(lines):
+    """
+    Read shipments from json lines, blank lines are skipped.
+
+    Yields:
+        Tuple: the number of the line and the shipment data, or None and the error if it is not a json object.
+    """
+
+    for number, line in enumerate(_decode(lines), 1):
+        if not line.strip():
+            continue
+        try:
+            data = json.loads(line)
+        except ValueError:
+            yield number, None, "Not a valid json line"
+            continue
+        if not isinstance(data, dict):
+            yield number, None, "Each line should be a json object"
+            continue
+        yield number, data, None
+
+
+def read_csv(lines):
+    """
+    Read shipments from csv lines, the first line is the header naming the fields.
+
+    Yields:
+        Tuple: the number of the line and the shipment data, the error is always None.
+    """
+
+    reader = csv.DictReader(_decode(lines))
+    for data in reader:
+        # `restkey` collects the values of the extra columns, they are ignored like unknown fields
+        data.pop(None, None)
+        yield reader.line_num, data, None
+
+
+READERS = {
+    CSV: read_csv,
+    JSONL: read_jsonl,
+}
+
+
+def import_shipments(rows, owner, batch_size=IMPORT_BATCH_SIZE):
+    """
+    Validate and create shipments in batches, only one batch is held in memory at a time.
+    Each batch is inserted with a single `bulk_create`, the invalid rows are reported and skipped.
+
+    Args:
+        rows (Iterable[Tuple]): (line number, data, error) as yielded by `read_csv` and `read_jsonl`.
+        owner (User): The owner of the created shipments.
+        batch_size (int): The number of shipments inserted per query.
+
+    Yields:
+        Dict: the result of every row in the order of `rows`, with the tracking id of the created shipment
+            or the errors of the row.
+    """
+
+    for batch in chunked(rows, batch_size):
+        results, shipments = [], []
+        for line, data, error in batch:
+            if error is not None:
+                results.append({"line": line, "success": False, "errors": error})
+                continue
+
+            serializer = ShipmentSerializer(data=data)
+            if not serializer.is_valid():
+                results.append({"line": line, "success": False, "errors": serializer.errors})
+                continue
+
+            shipment = Shipment(owner=owner, **serializer.validated_data)
+            shipments.append(shipment)
+            results.append({"line": line, "success": True, "tracking_id": shipment.tracking_id})
+
+        Shipment.objects.bulk_create(shipments, batch_size=batch_size)
+        yield from results
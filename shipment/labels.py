@@ -0,0 +1,401 @@
+import io
+import os
+import json
+import hashlib
+import logging
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+import pdfkit
+from jinja2 import Environment, FileSystemLoader
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+from rest_framework.utils.encoders import JSONEncoder
+
+from shipment import pdf
+from shipment.streaming import StreamBuffer
+
+logger = logging.getLogger(__name__)
+
+TEMPLATES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+LABEL_TEMPLATE = 'label.html'
+
+
+@lru_cache(maxsize=None)
+def get_template():
+    """Return the label template, it is loaded once per process."""
+
+    env = Environment(loader=FileSystemLoader(TEMPLATES_DIR))
+    return env.get_template(LABEL_TEMPLATE)
+
+
+@lru_cache(maxsize=None)
+def template_version():
+    """Return the checksum of the label template, a new template invalidates all the cached labels."""
+
+    with open(os.path.join(TEMPLATES_DIR, LABEL_TEMPLATE), 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def label_lines(context):
+    """
+    Return the text of a label as (font, size, text) paragraphs, the same text as `label.html`.
+
+    Args:
+        context (Dict): the data drawn on the label, `Shipment.to_dict()`.
+    """
+
+    return [
+        (pdf.BOLD, 24, "Zid Shipping"),
+        (pdf.BOLD, 18, str(context['title'])),
+        (pdf.REGULAR, 12, f"Tracking Id is {context['tracking_id']}"),
+        (pdf.REGULAR, 12, f"receiver name is {context['receiver_name']}"),
+        (pdf.REGULAR, 12, f"receiver country is {context['receiver_country']}"),
+        (pdf.REGULAR, 12, f"receiver address is {context['receiver_address']}"),
+        (pdf.REGULAR, 12, f"weight is {context['weight']}"),
+    ]
+
+
+class WkhtmltopdfLabelRenderer:
+    """Render `label.html` with wkhtmltopdf, it starts a wkhtmltopdf process for every label."""
+
+    name = 'wkhtmltopdf'
+
+    def render(self, context):
+        return pdfkit.from_string(get_template().render(**context), False)
+
+    def render_document(self, contexts):
+        """
+        Render many labels as the pages of one pdf document with a single wkhtmltopdf process.
+        The whole batch is rendered before the document is returned.
+
+        Yields:
+            Bytes: the pdf document.
+        """
+
+        template = get_template()
+        html = "".join(f'<div style="page-break-after: always">{template.render(**context)}</div>'
+                       for context in contexts)
+        yield pdfkit.from_string(html, False)
+
+
+class NativeLabelRenderer:
+    """
+    Draw the label fields directly to pdf inside the process.
+    Labels with text the standard pdf fonts can't draw raise `pdf.UnsupportedText`.
+    """
+
+    name = 'native'
+
+    def render(self, context):
+        output = io.BytesIO()
+        writer = pdf.PdfWriter(output)
+        writer.add_page(label_lines(context))
+        writer.close()
+        return output.getvalue()
+
+    def render_document(self, contexts):
+        """
+        Render many labels as the pages of one pdf document, written page by page while it is consumed.
+        The labels with text the standard fonts can't draw are rendered alone by wkhtmltopdf
+        and their pages copied in the document, so only one label is held in memory at a time.
+
+        Yields:
+            Bytes: the chunks of the pdf document.
+        """
+
+        output = StreamBuffer()
+        writer = pdf.PdfWriter(output)
+        yield output.pop()
+        for context in contexts:
+            try:
+                writer.add_page(label_lines(context))
+            except pdf.UnsupportedText:
+                writer.add_document(WkhtmltopdfLabelRenderer().render(context))
+            yield output.pop()
+        writer.close()
+        yield output.pop()
+
+
+@lru_cache(maxsize=None)
+def get_renderer(path=None):
+    """Return the label renderer at `path`, defaults to `settings.LABEL_RENDERER`."""
+
+    return import_string(path or settings.LABEL_RENDERER)()
+
+
+def label_digest(context):
+    """
+    Return the content address of a label.
+
+    Args:
+        context (Dict): the data drawn on the label, `Shipment.to_dict()`.
+
+    Returns:
+        String: the hash of the label data, the template version and the renderer.
+    """
+
+    content = json.dumps(context, cls=JSONEncoder, sort_keys=True) + template_version() + get_renderer().name
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def render_label(context):
+    """
+    Render a label to pdf with the configured renderer,
+    falling back to wkhtmltopdf for the labels it can not render.
+
+    Args:
+        context (Dict): the data drawn on the label, `Shipment.to_dict()`.
+
+    Returns:
+        Byte: the label in pdf format.
+    """
+
+    try:
+        return get_renderer().render(context)
+    except pdf.UnsupportedText:
+        return WkhtmltopdfLabelRenderer().render(context)
+
+
+class FileSystemLabelStore:
+    """
+    Keep the labels as files in a local directory.
+
+    Files are named `<tracking id>/<digest>.pdf` and are touched when read, once the directory grows
+    over `max_size` bytes the least recently used labels are removed until it is back under 90% of it.
+    """
+
+    def __init__(self, directory, max_size=512 * 1024 * 1024):
+        self.directory = directory
+        self.max_size = max_size
+        # the labels of a request are rendered and stored by several threads
+        self._lock = threading.Lock()
+        self._size = None
+        os.makedirs(directory, exist_ok=True)
+
+    def _label_directory(self, tracking_id):
+        return os.path.join(self.directory, str(tracking_id))
+
+    def _path(self, tracking_id, digest):
+        return os.path.join(self._label_directory(tracking_id), f"{digest}.pdf")
+
+    def get(self, tracking_id, digest):
+        path = self._path(tracking_id, digest)
+        try:
+            with open(path, 'rb') as f:
+                label = f.read()
+            os.utime(path)
+            return label
+        except FileNotFoundError:
+            return None
+
+    def set(self, tracking_id, digest, label):
+        # write to a temporary file then rename, so readers never see a partial label
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(label)
+        path = self._path(tracking_id, digest)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp_path, path)
+        except FileNotFoundError:
+            # the directory was removed by `delete` or `_evict` meanwhile
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp_path, path)
+
+        with self._lock:
+            if self._size is None:
+                self._size = self._disk_usage()
+            else:
+                self._size += len(label)
+
+            if self._size > self.max_size:
+                self._evict()
+
+    def delete(self, tracking_id):
+        directory = self._label_directory(tracking_id)
+        try:
+            with os.scandir(directory) as entries:
+                labels = [(entry.path, entry.stat().st_size) for entry in entries]
+        except FileNotFoundError:
+            return
+
+        removed = 0
+        for path, size in labels:
+            try:
+                os.remove(path)
+                removed += size
+            except FileNotFoundError:
+                pass
+        self._remove_directory(directory)
+
+        with self._lock:
+            if self._size is not None:
+                self._size = max(self._size - removed, 0)
+
+    def _remove_directory(self, directory):
+        try:
+            os.rmdir(directory)
+        except OSError:
+            # a label was stored meanwhile
+            pass
+
+    def _entries(self):
+        entries = []
+        with os.scandir(self.directory) as children:
+            for child in children:
+                if child.name.endswith('.pdf'):
+                    # a label stored before they were kept by tracking id
+                    entries.append(child)
+                elif child.is_dir():
+                    try:
+                        with os.scandir(child.path) as labels:
+                            entries.extend(entry for entry in labels if entry.name.endswith('.pdf'))
+                    except FileNotFoundError:
+                        pass
+        return entries
+
+    def _disk_usage(self):
+        return sum(entry.stat().st_size for entry in self._entries())
+
+    def _evict(self):
+        # other processes write in the same directory, so the size is measured again before evicting
+        entries = sorted(self._entries(), key=lambda entry: entry.stat().st_mtime)
+        size = sum(entry.stat().st_size for entry in entries)
+        for entry in entries:
+            if size <= self.max_size * .9:
+                break
+            try:
+                entry_size = entry.stat().st_size
+                os.remove(entry.path)
+                size -= entry_size
+            except FileNotFoundError:
+                pass
+            directory = os.path.dirname(entry.path)
+            if directory != self.directory:
+                self._remove_directory(directory)
+        self._size = size
+
+
+class DjangoCacheLabelStore:
+    """
+    Keep the labels in a Django cache, one entry per tracking id holding the digest and the label.
+
+    The eviction is left to the cache (`MAX_ENTRIES`, redis `maxmemory`), labels bigger than
+    `max_entry_size` bytes are not stored.
+    """
+
+    def __init__(self, alias='default', timeout=None, max_entry_size=1024 * 1024):
+        self.alias = alias
+        self.timeout = timeout
+        self.max_entry_size = max_entry_size
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def _key(self, tracking_id):
+        return f"label:{tracking_id}"
+
+    def get(self, tracking_id, digest):
+        entry = self.cache.get(self._key(tracking_id))
+        if entry and entry[0] == digest:
+            return entry[1]
+        return None
+
+    def set(self, tracking_id, digest, label):
+        if len(label) > self.max_entry_size:
+            return
+        self.cache.set(self._key(tracking_id), (digest, label), self.timeout)
+
+    def delete(self, tracking_id):
+        self.cache.delete(self._key(tracking_id))
+
+
+@lru_cache(maxsize=None)
+def get_label_store():
+    """Return the label store configured in `settings.LABEL_CACHE`."""
+
+    config = settings.LABEL_CACHE
+    return import_string(config['BACKEND'])(**config.get('OPTIONS', {}))
+
+
+@receiver(setting_changed)
+def reset_label_store(setting, **kwargs):
+    if setting == 'LABEL_CACHE':
+        get_label_store.cache_clear()
+    if setting == 'LABEL_RENDERER':
+        get_renderer.cache_clear()
+
+
+def get_or_render_label(tracking_id, context):
+    """
+    Return the cached label for this content, rendering and caching it on a miss.
+
+    Args:
+        tracking_id (str): The tracking id of the shipment.
+        context (Dict): the data drawn on the label, `Shipment.to_dict()`.
+
+    Returns:
+        Byte: the label in pdf format.
+    """
+
+    store = get_label_store()
+    digest = label_digest(context)
+
+    try:
+        label = store.get(tracking_id, digest)
+        if label is not None:
+            return label
+    except Exception as e:
+        logger.exception(f"Error {e} while reading the label of {tracking_id} from the cache")
+
+    label = render_label(context)
+
+    try:
+        store.set(tracking_id, digest, label)
+    except Exception as e:
+        logger.exception(f"Error {e} while caching the label of {tracking_id}")
+
+    return label
+
+
+def render_labels(shipments, workers=None):
+    """
+    Render the labels of the given shipments with a bounded pool of threads.
+    Cached labels and wkhtmltopdf renders are mostly waiting on IO, so threads render in parallel.
+    At most twice the number of workers labels are rendered ahead of the consumer,
+    so the memory used doesn't depend on the number of shipments.
+
+    Args:
+        shipments (Iterable[Shipment]): The shipments to render, consumed lazily.
+        workers (int): The number of labels rendered at the same time, defaults to
+            `settings.LABEL_RENDER_WORKERS`.
+
+    Yields:
+        Tuple: the shipment and the Bytes of its label in pdf format, in the order of `shipments`.
+    """
+
+    workers = workers or settings.LABEL_RENDER_WORKERS
+    pending = deque()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        try:
+            for shipment in shipments:
+                pending.append((shipment, executor.submit(shipment.get_label)))
+                if len(pending) >= workers * 2:
+                    shipment, future = pending.popleft()
+                    yield shipment, future.result()
+
+            while pending:
+                shipment, future = pending.popleft()
+                yield shipment, future.result()
+        finally:
+            for _, future in pending:
+                future.cancel()
@@ -0,0 +1,48 @@
+import time
+
+import numpy as np
+from geopy import distance as geopy_distance
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from shipment.distance import distance_from_store, METHODS
+
+
+class Command(BaseCommand):
+    help = "Compare the speed and accuracy of the numpy distance methods with the per shipment geopy path"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=10000, help="number of destinations")
+        parser.add_argument('--repeat', type=int, default=3, help="runs per method, the best one is reported")
+
+    def handle(self, *args, **options):
+        size = options['size']
+        rng = np.random.default_rng(0)
+        lats = rng.uniform(-60, 60, size)
+        lons = rng.uniform(-180, 180, size)
+        store = (settings.STORE_LAT, settings.STORE_LON)
+
+        def run_geopy():
+            return np.array([geopy_distance.distance(store, (lat, lon)).km for lat, lon in zip(lats, lons)])
+
+        reference, geopy_seconds = self._best_of(run_geopy, options['repeat'])
+        self._report("geopy (per row)", size, geopy_seconds, geopy_seconds, reference, reference)
+
+        for method in METHODS:
+            result, seconds = self._best_of(lambda: distance_from_store(lats, lons, method),
+                                            options['repeat'])
+            self._report(f"numpy {method}", size, seconds, geopy_seconds, result, reference)
+
+    def _best_of(self, func, repeat):
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = func()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return result, best
+
+    def _report(self, name, size, seconds, geopy_seconds, result, reference):
+        error = np.max(np.abs(result - reference))
+        self.stdout.write(f"{name:<18} {size / seconds:>14,.0f} rows/s {geopy_seconds / seconds:>9.1f}x "
+                          f"max error {error * 1000:.6f} m")
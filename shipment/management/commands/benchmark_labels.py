@@ -0,0 +1,60 @@
+import sys
+import time
+import resource
+import subprocess
+
+from django.core.management.base import BaseCommand
+
+from shipment.labels import get_renderer
+
+RENDERERS = (
+    'shipment.labels.NativeLabelRenderer',
+    'shipment.labels.WkhtmltopdfLabelRenderer',
+)
+
+
+class Command(BaseCommand):
+    help = "Compare labels per second and peak memory of the label renderers"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=200, help="number of labels to render")
+        parser.add_argument('--renderer', help="benchmark only this renderer, in the current process")
+
+    def handle(self, *args, **options):
+        if options['renderer']:
+            return self._benchmark(options['renderer'], options['count'])
+
+        # each renderer runs in its own process so the peak memory of one doesn't hide the other
+        for renderer in RENDERERS:
+            subprocess.run(
+                [sys.executable, sys.argv[0], 'benchmark_labels', f"--renderer={renderer}",
+                 f"--count={options['count']}"],
+                check=False,
+            )
+
+    def _benchmark(self, path, count):
+        renderer = get_renderer(path)
+        contexts = [{
+            "title": f"Shipment {index}",
+            "receiver_name": "Alaa",
+            "receiver_country": "EG",
+            "receiver_address": "Cairo",
+            "weight": 1.5,
+            "state": "SCHEDULED",
+            "tracking_id": f"{index:032d}",
+        } for index in range(count)]
+
+        start = time.perf_counter()
+        try:
+            size = sum(len(renderer.render(context)) for context in contexts)
+        except Exception as e:
+            self.stderr.write(f"{renderer.name:<12} failed: {e}")
+            return
+        elapsed = time.perf_counter() - start
+
+        # ru_maxrss is in KB on linux
+        process_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        children_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+        self.stdout.write(f"{renderer.name:<12} {count / elapsed:>10,.1f} labels/s "
+                          f"peak RSS {process_rss:,.1f} MB (child processes {children_rss:,.1f} MB) "
+                          f"average label {size / count / 1024:,.1f} KB")
@@ -0,0 +1,18 @@
+# Generated by Django 2.2 on 2026-10-18 18:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shipment', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shipment',
+            name='estimation_model_version',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+    ]
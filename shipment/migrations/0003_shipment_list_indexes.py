@@ -0,0 +1,89 @@
+# Generated by Django 2.2 on 2026-10-18 18:55
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def add_index_concurrently(index, columns):
+    """Build the index without locking the shipments table against writes, django 2.2 has no
+    `AddIndexConcurrently` so the SQL is run by hand and the index is only added to the model state."""
+
+    return migrations.SeparateDatabaseAndState(
+        database_operations=[
+            migrations.RunSQL(
+                f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {index.name} ON shipment_shipment ({columns})",
+                reverse_sql=f"DROP INDEX CONCURRENTLY IF EXISTS {index.name}",
+            ),
+        ],
+        state_operations=[migrations.AddIndex(model_name='shipment', index=index)],
+    )
+
+
+def drop_fk_index_concurrently(field_name, index_name):
+    """Drop the implicit index of a foreign key, it is a prefix of the composite `(field, -id)` index
+    and would only slow down the inserts and updates of the bulk paths."""
+
+    return migrations.SeparateDatabaseAndState(
+        database_operations=[
+            migrations.RunSQL(
+                f"DROP INDEX CONCURRENTLY IF EXISTS {index_name}",
+                reverse_sql=f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {index_name} "
+                            f"ON shipment_shipment ({field_name}_id)",
+            ),
+        ],
+        state_operations=[
+            migrations.AlterField(
+                model_name='shipment',
+                name=field_name,
+                field=models.ForeignKey(blank=True, db_index=False, null=True,
+                                        on_delete=django.db.models.deletion.DO_NOTHING,
+                                        related_name='shipments' if field_name == 'owner' else None,
+                                        to=settings.AUTH_USER_MODEL),
+            ),
+        ],
+    )
+
+
+class Migration(migrations.Migration):
+
+    # CREATE INDEX CONCURRENTLY can not run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('shipment', '0002_shipment_estimation_model_version'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        add_index_concurrently(
+            models.Index(fields=['owner', '-id'], name='shipment_owner_id_idx'),
+            "owner_id, id DESC",
+        ),
+        add_index_concurrently(
+            models.Index(fields=['owner', 'state', '-id'], name='shipment_owner_state_id_idx'),
+            "owner_id, state, id DESC",
+        ),
+        add_index_concurrently(
+            models.Index(fields=['driver', '-id'], name='shipment_driver_id_idx'),
+            "driver_id, id DESC",
+        ),
+        add_index_concurrently(
+            models.Index(fields=['driver', 'state', '-id'], name='shipment_driver_state_id_idx'),
+            "driver_id, state, id DESC",
+        ),
+        add_index_concurrently(
+            models.Index(fields=['state', '-id'], name='shipment_state_id_idx'),
+            "state, id DESC",
+        ),
+        add_index_concurrently(
+            models.Index(fields=['created_at'], name='shipment_created_at_idx'),
+            "created_at",
+        ),
+        add_index_concurrently(
+            models.Index(fields=['updated_at'], name='shipment_updated_at_idx'),
+            "updated_at",
+        ),
+        drop_fk_index_concurrently('owner', 'shipment_shipment_owner_id_fa6930f6'),
+        drop_fk_index_concurrently('driver', 'shipment_shipment_driver_id_d3b71837'),
+    ]
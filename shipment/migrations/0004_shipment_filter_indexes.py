@@ -0,0 +1,47 @@
+# Generated by Django 2.2 on 2026-10-18 18:57
+
+from django.db import migrations, models
+
+
+def add_index_concurrently(index, columns):
+    """Build the index without locking the shipments table against writes, see migration 0003."""
+
+    return migrations.SeparateDatabaseAndState(
+        database_operations=[
+            migrations.RunSQL(
+                f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {index.name} ON shipment_shipment ({columns})",
+                reverse_sql=f"DROP INDEX CONCURRENTLY IF EXISTS {index.name}",
+            ),
+        ],
+        state_operations=[migrations.AddIndex(model_name='shipment', index=index)],
+    )
+
+
+class Migration(migrations.Migration):
+
+    # CREATE INDEX CONCURRENTLY can not run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('shipment', '0003_shipment_list_indexes'),
+    ]
+
+    operations = [
+        add_index_concurrently(
+            models.Index(fields=['receiver_country', '-id'], name='shipment_country_id_idx'),
+            "receiver_country, id DESC",
+        ),
+        add_index_concurrently(
+            models.Index(fields=['scheduled_at'], name='shipment_scheduled_at_idx'),
+            "scheduled_at",
+        ),
+        add_index_concurrently(
+            models.Index(fields=['estimated_shipping_date'], name='shipment_estimated_date_idx'),
+            "estimated_shipping_date",
+        ),
+        migrations.RunSQL(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS shipment_search_idx ON shipment_shipment USING gin "
+            "((to_tsvector('simple'::regconfig, coalesce(title, '') || ' ' || coalesce(receiver_name, ''))))",
+            reverse_sql="DROP INDEX CONCURRENTLY IF EXISTS shipment_search_idx",
+        ),
+    ]
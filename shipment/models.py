@@ -1,19 +1,181 @@
 import uuid
-import pdfkit
+import logging
+import numpy as np
 from datetime import timedelta, datetime
-from geopy import distance
-from jinja2 import Environment, FileSystemLoader
 from django.conf import settings
 from django.core.exceptions import ValidationError
-from django.db import models
+from django.db import models, transaction
+from eventful import events
 from eventful.models import Event
-from .estimation_model import predict
+from .distance import distance_from_store
+from .estimation_model import predict_with_version, predict_many
+from .labels import get_label_store, get_or_render_label
+from .streaming import chunked
+from .tasks import prerender_labels
+
+logger = logging.getLogger(__name__)
+
+# Number of shipments estimated together in one call to the model.
+ESTIMATION_CHUNK_SIZE = 1000
+
+# Number of labels rendered by one celery task after scheduling.
+PRERENDER_CHUNK_SIZE = 100
 
 
 def generate_tracking_id():
     return str(uuid.uuid4()).replace('-', '')
 
 
+def enqueue_prerender(tracking_ids):
+    """
+    Render the labels of the shipments in the background. It is only a warm up, the labels not
+    rendered because the task can not be sent, e.g. while the broker is down, are rendered when printed.
+    """
+
+    try:
+        prerender_labels.delay(tracking_ids)
+    except Exception as e:
+        logger.exception(f"Error {e} while enqueuing the prerender of {len(tracking_ids)} labels")
+
+
+def estimate_delivery_dates(lats, lons, system_load=.5):
+    """
+    Estimate the delivery dates of many shipments at once.
+
+    Args:
+        lats (Iterable): The latitudes of the destinations.
+        lons (Iterable): The longitudes of the destinations.
+        system_load (float): The load of the system from 0 to 1.
+
+    Returns:
+        Tuple: a list of the estimated delivery dates and the version of the model used.
+    """
+
+    distances = distance_from_store(lats, lons)
+    days, version = predict_many(distances, system_load)
+
+    now = datetime.now()
+    return [now + timedelta(days=int(number_of_days)) for number_of_days in np.round(days)], version
+
+
+class ShipmentQuerySet(models.QuerySet):
+    def estimate_many(self, system_load=.5, chunk_size=ESTIMATION_CHUNK_SIZE):
+        """
+        Estimate the delivery dates of the shipments in this queryset.
+        The shipments are read and estimated in chunks of `chunk_size`, one model call per chunk.
+
+        Args:
+            system_load (float): The load of the system from 0 to 1.
+            chunk_size (int): The number of shipments estimated together.
+
+        Yields:
+            Tuple: the tracking id, the estimated delivery date and the version of the model used.
+        """
+
+        rows = self.values_list('tracking_id', 'lat', 'lon').iterator(chunk_size=chunk_size)
+        for chunk in chunked(rows, chunk_size):
+            tracking_ids, lats, lons = zip(*chunk)
+            dates, version = estimate_delivery_dates(lats, lons, system_load)
+            for tracking_id, date in zip(tracking_ids, dates):
+                yield tracking_id, date, version
+
+    def schedule_bulk(self, batch_size=ESTIMATION_CHUNK_SIZE):
+        """
+        Schedule the delivery of all the shipments in this queryset in a single transaction.
+        The state transitions are checked in memory, the delivery dates are estimated in one batch
+        and the shipments are written back with `bulk_update`, their events are saved to the outbox with them.
+        Shipments that can not be scheduled are reported and skipped, they don't abort the others.
+
+        Args:
+            batch_size (int): The number of shipments updated per query.
+
+        Returns:
+            Tuple: a list of the scheduled shipments and a dict of tracking id to error for the others.
+        """
+
+        with transaction.atomic():
+            scheduled, errors = [], {}
+            for shipment in self.select_for_update():
+                try:
+                    shipment.check_state_transition(Shipment.SCHEDULED)
+                    scheduled.append(shipment)
+                except ValidationError as e:
+                    errors[shipment.tracking_id] = e.message
+
+            if not scheduled:
+                return scheduled, errors
+
+            dates, version = estimate_delivery_dates([shipment.lat for shipment in scheduled],
+                                                     [shipment.lon for shipment in scheduled])
+            # the columns are dates, the events are built from the shipments as they are stored
+            today = datetime.now().date()
+            eta_changes = []
+            for shipment, date in zip(scheduled, dates):
+                previous_date = shipment.estimated_shipping_date
+                shipment.state = Shipment.SCHEDULED
+                shipment.scheduled_at = today
+                shipment.estimated_shipping_date = date.date()
+                shipment.estimation_model_version = version
+                # the first estimate is a change from no ETA
+                if shipment.estimated_shipping_date != previous_date:
+                    eta_changes.append((shipment.owner_id, shipment.eta_changed_payload(previous_date)))
+
+            self.model.objects.bulk_update(
+                scheduled,
+                ['state', 'scheduled_at', 'estimated_shipping_date', 'estimation_model_version'],
+                batch_size=batch_size,
+            )
+            Event.publish_many(events.SHIPMENT_SCHEDULED.name,
+                               [(shipment.owner_id, shipment.to_dict()) for shipment in scheduled])
+            Event.publish_many(events.SHIPMENT_ETA_CHANGED.name, eta_changes)
+
+        for shipment in scheduled:
+            shipment.invalidate_label()
+
+        tracking_ids = [shipment.tracking_id for shipment in scheduled]
+        for chunk in chunked(tracking_ids, PRERENDER_CHUNK_SIZE):
+            transaction.on_commit(lambda chunk=chunk: enqueue_prerender(chunk))
+
+        return scheduled, errors
+
+    def update_states(self, states, batch_size=ESTIMATION_CHUNK_SIZE):
+        """
+        Change the state of many shipments in a single transaction.
+        The events of the changes are saved to the outbox in the same transaction, with one query.
+        Shipments that can not move to their new state are reported and skipped, they don't abort the others.
+
+        Args:
+            states (Dict): tracking id to the new state of the shipment.
+            batch_size (int): The number of shipments updated per query.
+
+        Returns:
+            Tuple: a list of the updated shipments and a dict of tracking id to error for the others.
+        """
+
+        with transaction.atomic():
+            updated, errors = [], {}
+            for shipment in self.filter(tracking_id__in=states).select_for_update():
+                state = states[shipment.tracking_id].upper()
+                try:
+                    shipment.check_state_transition(state)
+                    shipment.state = state
+                    updated.append(shipment)
+                except ValidationError as e:
+                    errors[shipment.tracking_id] = e.message
+
+            if not updated:
+                return updated, errors
+
+            self.model.objects.bulk_update(updated, ['state'], batch_size=batch_size)
+            for shipment in updated:
+                shipment.invalidate_label()
+
+            Event.publish_many(events.SHIPMENT_STATE_CHANGED.name,
+                               [(shipment.owner_id, shipment.to_dict()) for shipment in updated])
+
+        return updated, errors
+
+
 class Shipment(models.Model):
     PENDING = 'PENDING'
     SCHEDULED = "SCHEDULED"
@@ -30,11 +192,13 @@ class Shipment(models.Model):
     driver = models.ForeignKey(settings.AUTH_USER_MODEL,
                                null=True,
                                blank=True,
+                               db_index=False,  # covered by the (driver, -id) index
                                on_delete=models.DO_NOTHING)
     owner = models.ForeignKey(settings.AUTH_USER_MODEL,
                               related_name='shipments',
                               null=True,
                               blank=True,
+                              db_index=False,  # covered by the (owner, -id) index
                               on_delete=models.DO_NOTHING)
 
     title = models.CharField(max_length=250)
@@ -43,6 +207,7 @@ class Shipment(models.Model):
     receiver_address = models.CharField(max_length=300)
     estimated_shipping_date = models.DateField(null=True)
     scheduled_at = models.DateField(null=True)
+    estimation_model_version = models.CharField(max_length=64, blank=True, default="")
     weight = models.FloatField()
     lat = models.DecimalField(max_digits=12, decimal_places=8)
     lon = models.DecimalField(max_digits=12, decimal_places=8)
@@ -51,13 +216,22 @@ class Shipment(models.Model):
     created_at = models.DateTimeField(auto_now=True)
     updated_at = models.DateTimeField(auto_now_add=True)
 
+    objects = ShipmentQuerySet.as_manager()
+
     def __str__(self):
         return self.title
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self.invalidate_label()
+
     def schedule(self):
         """
         Schedual the shipment delivery
         This will change it's state to `SCHEDULED`, also will calculate the estimated delivery date
+        and render its label in the background once the change is committed.
+        The `SHIPMENT_SCHEDULED` event is saved to the outbox with the change, and `SHIPMENT_ETA_CHANGED`
+        when the estimated date is another day than the previous one, the first estimate is a change too.
 
         Args:
             self: The shipment object
@@ -67,14 +241,63 @@ class Shipment(models.Model):
         """
 
         self.check_state_transition(self.SCHEDULED)
+        previous_date = self.estimated_shipping_date
         self.state = self.SCHEDULED
-        self.scheduled_at = datetime.now()
-        self.estimated_shipping_date = self.estimate_delivery_date()
-        self.save()
+        # the columns are dates, the events are built from the shipment as it is stored
+        self.scheduled_at = datetime.now().date()
+        self.estimated_shipping_date = self.estimate_delivery_date().date()
+        eta_changed = self.estimated_shipping_date != previous_date
+        with transaction.atomic():
+            self.save()
+            Event.publish(events.SHIPMENT_SCHEDULED.name, self.owner_id, self.to_dict())
+            if eta_changed:
+                Event.publish(events.SHIPMENT_ETA_CHANGED.name, self.owner_id,
+                              self.eta_changed_payload(previous_date))
+        transaction.on_commit(lambda: enqueue_prerender([self.tracking_id]))
+
+    def assign_driver(self, driver):
+        """
+        Assign a driver to deliver the shipment, the `SHIPMENT_DRIVER_ASSIGNED` event is saved to the outbox
+        with the change.
+
+        Args:
+            self: The shipment object
+            driver: the user of type `DRIVER` delivering the shipment
+
+        Returns:
+            None
+        """
+
+        self.driver = driver
+        with transaction.atomic():
+            self.save()
+            Event.publish(events.SHIPMENT_DRIVER_ASSIGNED.name, self.owner_id,
+                          {**self.to_dict(), "driver_id": driver.id})
+
+    def attach_documents(self, files):
+        """
+        Attach documents to the shipment, the `SHIPMENT_DOCUMENTS_ATTACHED` event is saved to the outbox
+        with them.
+
+        Args:
+            self: The shipment object
+            files (List[File]): the uploaded documents
+
+        Returns:
+            List[ShipmentDocument]: the attached documents.
+        """
+
+        with transaction.atomic():
+            documents = [ShipmentDocument.objects.create(document=file, shipment=self) for file in files]
+            Event.publish(events.SHIPMENT_DOCUMENTS_ATTACHED.name, self.owner_id, {
+                **self.to_dict(),
+                "documents": [document.document.name for document in documents],
+            })
+        return documents
 
     def update_state(self, state):
         """
-        Change the state of the shipment.
+        Change the state of the shipment, the event of the change is saved to the outbox with it.
 
         Args:
             self: The shipment object
@@ -90,8 +313,9 @@ class Shipment(models.Model):
         state = state.upper()
         self.check_state_transition(state)
         self.state = state
-        self.save()
-        Event.dispatch("SHIPMENT_STATE_CHANGED", self.owner_id, self.to_dict())
+        with transaction.atomic():
+            self.save()
+            Event.publish(events.SHIPMENT_STATE_CHANGED.name, self.owner_id, self.to_dict())
 
     def check_state_transition(self, final_state):
         """
@@ -120,7 +344,7 @@ class Shipment(models.Model):
 
     def get_label(self):
         """
-        Return the pdf representation of this shipment
+        Return the pdf representation of this shipment, it is rendered only if it is not in the label cache.
 
         Args:
             self: The shipment object
@@ -129,16 +353,20 @@ class Shipment(models.Model):
             Byte: the Byte representation of the shipment label in pdf format.
         """
 
-        file_loader = FileSystemLoader('shipment/templates')
-        env = Environment(loader=file_loader)
-        template = env.get_template('label.html')
+        return get_or_render_label(self.tracking_id, self.to_dict())
 
-        str_temp = template.render(**self.to_dict())
-        return pdfkit.from_string(str_temp, False)
+    def invalidate_label(self):
+        """Remove the cached label of this shipment"""
+
+        try:
+            get_label_store().delete(self.tracking_id)
+        except Exception as e:
+            logger.exception(f"Error {e} while removing the cached label of {self.tracking_id}")
 
     def estimate_delivery_date(self):
         """
         Estimate the delivery date of the shipment based on the distance and system load.
+        The version of the model used is kept in `estimation_model_version`.
 
         Args:
             self: The shipment object
@@ -148,7 +376,7 @@ class Shipment(models.Model):
         """
 
         distance = self.calculate_distance()
-        number_of_days = predict(distance, .5)
+        number_of_days, self.estimation_model_version = predict_with_version(distance, .5)
         return datetime.now() + timedelta(days=round(number_of_days))
 
     def calculate_distance(self):
@@ -162,9 +390,7 @@ class Shipment(models.Model):
             Float: the Distance in (KM) from the shipping store to the final destination.
         """
 
-        coordinates_from = [settings.STORE_LAT, settings.STORE_LON]
-        coordinates_to = [self.lat, self.lon]
-        return distance.distance(coordinates_from, coordinates_to).km
+        return float(distance_from_store(self.lat, self.lon))
 
     def to_dict(self):
         """
@@ -191,7 +417,26 @@ class Shipment(models.Model):
             "lon": self.lon
         }
 
+    def eta_changed_payload(self, previous_date):
+        """Return the payload of the `SHIPMENT_ETA_CHANGED` event, with the previous estimated date."""
+
+        return {**self.to_dict(), "previous_estimated_shipping_date": previous_date}
+
     class Meta:
+        indexes = [
+            # the list pages by id, filtered by owner (developers), driver (drivers) or nothing (admins)
+            models.Index(fields=['owner', '-id'], name='shipment_owner_id_idx'),
+            models.Index(fields=['owner', 'state', '-id'], name='shipment_owner_state_id_idx'),
+            models.Index(fields=['driver', '-id'], name='shipment_driver_id_idx'),
+            models.Index(fields=['driver', 'state', '-id'], name='shipment_driver_state_id_idx'),
+            models.Index(fields=['state', '-id'], name='shipment_state_id_idx'),
+            models.Index(fields=['created_at'], name='shipment_created_at_idx'),
+            models.Index(fields=['updated_at'], name='shipment_updated_at_idx'),
+            models.Index(fields=['receiver_country', '-id'], name='shipment_country_id_idx'),
+            models.Index(fields=['scheduled_at'], name='shipment_scheduled_at_idx'),
+            models.Index(fields=['estimated_shipping_date'], name='shipment_estimated_date_idx'),
+            # the full text search index `shipment_search_idx` is created in migration 0004
+        ]
         permissions = [("change_shipment_state", "Can change the status of shipments"),
                        ("print_shipment_labels", "Can print labels for given shipments"),
                        ("schedule_shipment", "Can schedule shipments delivery"),
@@ -0,0 +1,13 @@
+from rest_framework.pagination import CursorPagination
+
+
+class ShipmentCursorPagination(CursorPagination):
+    """
+    Keyset pagination on the shipment id, newest first.
+    Each page is an index range scan from the cursor, so it costs the same on any page.
+    """
+
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+    ordering = '-id'
@@ -0,0 +1,177 @@
+import io
+import copy
+import textwrap
+
+from pypdf import PdfReader
+from pypdf.generic import ArrayObject, DictionaryObject, IndirectObject, NameObject
+
+# A4 in points, the page size wkhtmltopdf uses by default
+A4 = (595, 842)
+
+MARGIN = 50
+
+REGULAR = 'F1'
+BOLD = 'F2'
+
+FONTS = {
+    REGULAR: 'Helvetica',
+    BOLD: 'Helvetica-Bold',
+}
+
+# The first object numbers are fixed, pages are numbered after them
+CATALOG, PAGES, FIRST_FONT = 1, 2, 3
+
+# The attributes a page can inherit from the page tree, copied with the pages of other documents
+INHERITABLE = ('/Resources', '/MediaBox', '/CropBox', '/Rotate')
+
+
+class UnsupportedText(ValueError):
+    """The text has characters the standard PDF fonts can not draw."""
+
+
+def _escape(text, strict=True):
+    try:
+        encoded = text.encode('cp1252', errors='strict' if strict else 'replace')
+    except UnicodeEncodeError as e:
+        raise UnsupportedText(f"Can not draw {text!r} with the standard fonts") from e
+    return encoded.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)')
+
+
+def _serialize(obj):
+    output = io.BytesIO()
+    obj.write_to_stream(output)
+    return output.getvalue()
+
+
+class PdfWriter:
+    """
+    Write a text only PDF document page by page to a binary stream.
+
+    Each page is written to the stream as soon as it is added, only the offsets of the objects are
+    kept until `close()` writes the page tree and the cross reference table.
+    Text is drawn with the standard Helvetica fonts, so only characters of the Windows-1252 charset
+    can be drawn, anything else raises `UnsupportedText` or is drawn as `?` if `strict` is False.
+    Pages with other text can be rendered by another tool and copied with `add_document()`.
+    """
+
+    def __init__(self, stream, page_size=A4, strict=True):
+        self.stream = stream
+        self.page_size = page_size
+        self.strict = strict
+        self._position = 0
+        self._offsets = {}
+        self._pages = []
+        self._next_object = FIRST_FONT + len(FONTS)
+
+        self._write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+        self._write_object(CATALOG, b"<< /Type /Catalog /Pages %d 0 R >>" % PAGES)
+        for number, name in enumerate(FONTS.values(), FIRST_FONT):
+            self._write_object(
+                number, b"<< /Type /Font /Subtype /Type1 /BaseFont /%s /Encoding /WinAnsiEncoding >>" %
+                name.encode())
+
+    def _write(self, data):
+        self.stream.write(data)
+        self._position += len(data)
+
+    def _write_object(self, number, body):
+        self._offsets[number] = self._position
+        self._write(b"%d 0 obj\n%s\nendobj\n" % (number, body))
+
+    def _allocate(self):
+        number = self._next_object
+        self._next_object += 1
+        return number
+
+    def add_page(self, lines):
+        """
+        Draw a page of text.
+
+        Args:
+            lines (Iterable[Tuple]): (font, size, text) for each paragraph, from the top of the page,
+                long paragraphs are wrapped to the page width.
+        """
+
+        width, height = self.page_size
+        y = height - MARGIN
+        commands = []
+        for font, size, text in lines:
+            max_chars = max(int((width - 2 * MARGIN) / (size * .5)), 1)
+            for line in textwrap.wrap(text, max_chars) or ['']:
+                y -= size * 1.4
+                commands.append(b"BT /%s %d Tf %d %d Td (%s) Tj ET" %
+                                (font.encode(), size, MARGIN, y, _escape(line, self.strict)))
+            y -= size * .6
+
+        content = b"\n".join(commands)
+        content_number, page_number = self._allocate(), self._allocate()
+        self._write_object(content_number,
+                           b"<< /Length %d >>\nstream\n%s\nendstream" % (len(content), content))
+
+        fonts = b" ".join(b"/%s %d 0 R" % (key.encode(), number)
+                          for number, key in enumerate(FONTS, FIRST_FONT))
+        self._write_object(
+            page_number, b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 %d %d] "
+            b"/Resources << /Font << %s >> >> /Contents %d 0 R >>" %
+            (PAGES, width, height, fonts, content_number))
+        self._pages.append(page_number)
+
+    def add_document(self, document):
+        """
+        Copy the pages of another pdf document, with the fonts and images they use.
+
+        Args:
+            document (Bytes): the pdf document, only one document is held in memory at a time.
+        """
+
+        numbers = {}
+        pending = []
+
+        def copy_object(obj):
+            if isinstance(obj, IndirectObject):
+                if obj.idnum not in numbers:
+                    numbers[obj.idnum] = self._allocate()
+                    pending.append(obj)
+                return IndirectObject(numbers[obj.idnum], 0, None)
+            if isinstance(obj, DictionaryObject):
+                # streams are dictionaries too, a shallow copy keeps their encoded data
+                copied = copy.copy(obj)
+                copied.update({key: copy_object(value) for key, value in obj.items() if key != '/Parent'})
+                return copied
+            if isinstance(obj, ArrayObject):
+                return ArrayObject(copy_object(value) for value in obj)
+            return obj
+
+        for page in PdfReader(io.BytesIO(document)).pages:
+            copied = DictionaryObject({NameObject('/Type'): NameObject('/Page'),
+                                       NameObject('/Parent'): IndirectObject(PAGES, 0, None)})
+            if '/Contents' in page:
+                copied[NameObject('/Contents')] = copy_object(page.raw_get('/Contents'))
+            for key in INHERITABLE:
+                node = page
+                while key not in node and '/Parent' in node:
+                    node = node['/Parent'].get_object()
+                if key in node:
+                    copied[NameObject(key)] = copy_object(node.raw_get(key))
+
+            while pending:
+                obj = pending.pop()
+                self._write_object(numbers[obj.idnum], _serialize(copy_object(obj.get_object())))
+
+            page_number = self._allocate()
+            self._write_object(page_number, _serialize(copied))
+            self._pages.append(page_number)
+
+    def close(self):
+        """Write the page tree and the cross reference table, the document is complete after it."""
+
+        kids = b" ".join(b"%d 0 R" % number for number in self._pages)
+        self._write_object(PAGES, b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(self._pages)))
+
+        xref_position = self._position
+        size = self._next_object
+        entries = [b"0000000000 65535 f \n"]
+        entries += [b"%010d 00000 n \n" % self._offsets[number] for number in range(1, size)]
+        self._write(b"xref\n0 %d\n%s" % (size, b"".join(entries)))
+        self._write(b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" %
+                    (size, CATALOG, xref_position))
@@ -0,0 +1,44 @@
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+
+class PassthroughRenderer(BaseRenderer):
+    """
+    Let views pick a binary output with `?format=`, the view builds the content itself.
+    Error responses are still rendered as json.
+    """
+
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, bytes):
+            return data
+
+        response = (renderer_context or {}).get('response')
+        if response is not None:
+            response['Content-Type'] = JSONRenderer.media_type
+        return JSONRenderer().render(data, accepted_media_type, renderer_context)
+
+
+class ZipRenderer(PassthroughRenderer):
+    media_type = 'application/zip'
+    format = 'zip'
+
+
+class PDFRenderer(PassthroughRenderer):
+    media_type = 'application/pdf'
+    format = 'pdf'
+
+
+class CSVRenderer(PassthroughRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+
+class JSONLinesRenderer(PassthroughRenderer):
+    media_type = 'application/x-ndjson'
+    format = 'jsonl'
+
+
+class ParquetRenderer(PassthroughRenderer):
+    media_type = 'application/vnd.apache.parquet'
+    format = 'parquet'
@@ -13,6 +13,15 @@ class DocumentSerializer(serializers.ModelSerializer):
 class ShipmentSerializer(serializers.ModelSerializer):
     documents = DocumentSerializer(many=True, read_only=True)
 
+    def __init__(self, *args, **kwargs):
+        # `fields` limits the output to these fields, e.g. to skip the documents
+        fields = kwargs.pop('fields', None)
+        super().__init__(*args, **kwargs)
+
+        if fields is not None:
+            for field_name in set(self.fields) - set(fields):
+                self.fields.pop(field_name)
+
     class Meta:
         model = Shipment
         fields = ('receiver_name', 'receiver_country', 'receiver_address', 'estimated_shipping_date', 'state',
@@ -0,0 +1,83 @@
+import zipfile
+from itertools import islice
+
+from django.http import StreamingHttpResponse
+from rest_framework.utils.encoders import JSONEncoder
+
+
+def chunked(iterable, size):
+    """Yield lists of at most `size` items from `iterable`."""
+
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def ndjson_response(rows, status=200):
+    """
+    Stream `rows` to the client as newline delimited json, one object per line.
+
+    Args:
+        rows (Iterable[Dict]): The objects to send, consumed lazily while the response is sent.
+
+    Returns:
+        StreamingHttpResponse: the response streaming the rows.
+    """
+
+    encoder = JSONEncoder()
+    lines = (encoder.encode(row) + "\n" for row in rows)
+    return StreamingHttpResponse(lines, content_type='application/x-ndjson', status=status)
+
+
+class StreamBuffer:
+    """
+    A write only, unseekable file object whose content is taken out with `pop()`.
+    It lets writers that expect a file (zipfile, csv, ...) produce a stream of chunks.
+    """
+
+    closed = False
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data):
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        """Return everything written since the last call."""
+
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def zip_stream(entries):
+    """
+    Build a zip archive while it is being sent, only one entry is held in memory at a time.
+
+    Args:
+        entries (Iterable[Tuple]): (file name, content) pairs to put in the archive.
+
+    Yields:
+        Bytes: the chunks of the zip archive.
+    """
+
+    buffer = StreamBuffer()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        for name, content in entries:
+            zf.writestr(name, content)
+            yield buffer.pop()
+    yield buffer.pop()
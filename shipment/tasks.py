@@ -0,0 +1,25 @@
+import logging
+
+from celery import shared_task
+from django.apps import apps
+
+from shipment.labels import render_labels
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task
+def prerender_labels(tracking_ids):
+    """
+    Render the labels of the given shipments ahead of printing and put them in the label cache.
+    func is celery task to take the rendering off the request path.
+    :type tracking_ids: list
+    """
+    Shipment = apps.get_model('shipment', 'Shipment')
+    shipments = Shipment.objects.filter(tracking_id__in=tracking_ids)
+
+    try:
+        for _ in render_labels(shipments.iterator()):
+            pass
+    except Exception as error:
+        logger.exception(f"Error {error} while rendering the labels of {tracking_ids}")
@@ -1,15 +1,43 @@
+import io
+import os
+import csv
 import json
 import mock
+import pickle
+import shutil
+import decimal
 import datetime
+import tempfile
 import zipfile
-import io
 
+import numpy as np
+import pyarrow.parquet as pq
+from pypdf import PdfReader
 from freezegun import freeze_time
-from django.test import TestCase
+from geopy import distance as geopy_distance
+from sklearn.linear_model import LinearRegression
+from django.db import connection, DatabaseError
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth.models import Group
 from django.core.files.uploadedfile import SimpleUploadedFile
 
-from shipment.models import Shipment
+from eventful import delivery
+from shipment import distance, pdf
+from shipment.models import Shipment, ShipmentDocument
+from shipment.pdf import PdfWriter
+from shipment.estimation_model import ModelRegistry
+from shipment.exports import export_rows
+from shipment.imports import import_shipments, read_jsonl
+from shipment.labels import (
+    render_label,
+    render_labels,
+    get_label_store,
+    DjangoCacheLabelStore,
+    NativeLabelRenderer,
+)
+from shipment.streaming import zip_stream
+from shipment.tasks import prerender_labels
 from profiles.fixtures_factory import (
     UserFactory,
     DeveloperProfileFactory,
@@ -23,6 +51,13 @@ class ShipmentTests(TestCase):
     fixtures = ['auth.json']
 
     def setUp(self):
+        self.label_directory = tempfile.mkdtemp()
+        self.settings = override_settings(LABEL_CACHE={
+            'BACKEND': 'shipment.labels.FileSystemLabelStore',
+            'OPTIONS': {'directory': self.label_directory},
+        })
+        self.settings.enable()
+
         self.developer1 = UserFactory(username="dev", role="DEVELOPER")
         self.developer1.set_password("dev")
         self.developer1.save()
@@ -41,6 +76,10 @@ class ShipmentTests(TestCase):
         Group.objects.get(name="DRIVER").user_set.add(self.driver)
         DriverProfileFactory(user=self.driver)
 
+    def tearDown(self):
+        self.settings.disable()
+        shutil.rmtree(self.label_directory)
+
     def _get_access_token(self, username, password):
 
         response = self.client.post(
@@ -101,6 +140,93 @@ class ShipmentTests(TestCase):
         )
         self.assertEquals(403, response.status_code)
 
+    def _import(self, access_token, content, content_type):
+        response = self.client.post(
+            '/api/v1/shipments/import/',
+            data=content,
+            content_type=content_type,
+            HTTP_AUTHORIZATION=f"Bearer {access_token}",
+        )
+        self.assertEquals(200, response.status_code)
+        return [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+
+    def test_developer_can_import_shipments_from_json_lines(self):
+        access_token = self._get_access_token(self.developer1.username, "dev")
+        shipment = {"receiver_name": "alaa", "receiver_country": "EG", "receiver_address": "Cairo",
+                    "weight": 1.5, "lat": 23.4545, "lon": 32.5454, "title": "Test_shipment"}
+        content = "\n".join([
+            json.dumps(shipment),
+            "not json",
+            "",
+            json.dumps({**shipment, "weight": "heavy"}),
+            json.dumps({**shipment, "title": "Second"}),
+        ])
+
+        results = self._import(access_token, content, 'application/x-ndjson')
+
+        self.assertEquals([1, 2, 4, 5], [result['line'] for result in results])
+        self.assertEquals([True, False, False, True], [result['success'] for result in results])
+        self.assertEquals({'weight': ['A valid number is required.']}, results[2]['errors'])
+        shipments = Shipment.objects.filter(owner=self.developer1).order_by('id')
+        self.assertEquals(['Test_shipment', 'Second'], [shipment.title for shipment in shipments])
+        self.assertEquals([results[0]['tracking_id'], results[3]['tracking_id']],
+                          [shipment.tracking_id for shipment in shipments])
+        self.assertEquals({Shipment.PENDING}, {shipment.state for shipment in shipments})
+
+    def test_developer_can_import_shipments_from_csv(self):
+        access_token = self._get_access_token(self.developer1.username, "dev")
+        content = (
+            "title,receiver_name,receiver_country,receiver_address,weight,lat,lon\n"
+            'First,alaa,EG,"Cairo, Egypt",1.5,23.4545,32.5454\n'
+            "Second,omar,EG,Giza,2,30.1,31.2\n"
+            "Third,omar,EG,Giza,2,,31.2\n"
+        )
+
+        results = self._import(access_token, content, 'text/csv')
+
+        self.assertEquals([2, 3, 4], [result['line'] for result in results])
+        self.assertEquals([True, True, False], [result['success'] for result in results])
+        self.assertIn('lat', results[2]['errors'])
+        shipment = Shipment.objects.get(tracking_id=results[0]['tracking_id'])
+        self.assertEquals(("First", "Cairo, Egypt", self.developer1),
+                          (shipment.title, shipment.receiver_address, shipment.owner))
+
+    def test_import_inserts_shipments_in_batches(self):
+        shipment = {"receiver_name": "alaa", "receiver_country": "EG", "receiver_address": "Cairo",
+                    "weight": 1.5, "lat": 23.4545, "lon": 32.5454, "title": "Test_shipment"}
+        lines = [json.dumps(shipment).encode()] * 5
+
+        with CaptureQueriesContext(connection) as queries:
+            results = list(import_shipments(read_jsonl(lines), self.developer1, batch_size=2))
+
+        self.assertEquals(5, len(results))
+        self.assertEquals(3, len([query for query in queries if query['sql'].startswith('INSERT')]))
+        self.assertEquals(5, Shipment.objects.filter(owner=self.developer1).count())
+
+    def test_import_rejects_unknown_formats(self):
+        access_token = self._get_access_token(self.developer1.username, "dev")
+
+        response = self.client.post(
+            '/api/v1/shipments/import/',
+            data="<shipments/>",
+            content_type='application/xml',
+            HTTP_AUTHORIZATION=f"Bearer {access_token}",
+        )
+
+        self.assertEquals(415, response.status_code)
+
+    def test_driver_can_not_import_shipments(self):
+        access_token = self._get_access_token(self.driver.username, "driver")
+
+        response = self.client.post(
+            '/api/v1/shipments/import/',
+            data="",
+            content_type='text/csv',
+            HTTP_AUTHORIZATION=f"Bearer {access_token}",
+        )
+
+        self.assertEquals(403, response.status_code)
+
     def test_developer_can_list_his_shipments(self):
         ShipmentFactory(owner=self.developer1)
         ShipmentFactory(owner=self.developer1)
@@ -116,7 +242,7 @@ class ShipmentTests(TestCase):
             HTTP_AUTHORIZATION=f"Bearer {access_token}",
         )
         self.assertEquals(200, response.status_code)
-        self.assertEquals(3, len(response.json()))
+        self.assertEquals(3, len(response.json()['results']))
 
     def test_driver_can_list_his_shipment(self):
         ShipmentFactory(owner=self.developer1)
@@ -133,7 +259,7 @@ class ShipmentTests(TestCase):
             HTTP_AUTHORIZATION=f"Bearer {access_token}",
         )
         self.assertEquals(200, response.status_code)
-        self.assertEquals(1, len(response.json()))
+        self.assertEquals(1, len(response.json()['results']))
 
     def test_admin_can_list_all_shipments(self):
         ShipmentFactory(owner=self.developer1, tracking_id=1)
@@ -150,9 +276,199 @@ class ShipmentTests(TestCase):
             HTTP_AUTHORIZATION=f"Bearer {access_token}",
         )
         self.assertEquals(200, response.status_code)
-        self.assertEquals(4, len(response.json()))
+        self.assertEquals(4, len(response.json()['results']))
+
+    def test_shipment_list_is_paginated_with_a_cursor(self):
+        for tracking_id in range(5):
+            ShipmentFactory(owner=self.developer1, tracking_id=str(tracking_id))
+
+        access_token = self._get_access_token(self.developer1.username, "dev")
+
+        response = self.client.get(
+            '/api/v1/shipments/?page_size=2',
+            content_type='application/json',
+            HTTP_AUTHORIZATION=f"Bearer {access_token}",
+        )
+        pages = [response.json()]
+        while pages[-1]['next']:
+            response = self.client.get(
+                pages[-1]['next'],
+                content_type='application/json',
+                HTTP_AUTHORIZATION=f"Bearer {access_token}",
+            )
+            pages.append(response.json())
+
+        self.assertEquals(3, len(pages))
+        self.assertEquals(['4', '3', '2', '1', '0'],
+                          [shipment['tracking_id'] for page in pages for shipment in page['results']])
+
+    def _count_list_queries(self, access_token, query=""):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(
+                f'/api/v1/shipments/{query}',
+                content_type='application/json',
+                HTTP_AUTHORIZATION=f"Bearer {access_token}",
+            )
+        self.assertEquals(200, response.status_code)
+        return len(context.captured_queries), response.json()['results']
+
+    def test_shipment_list_queries_do_not_grow_with_documents(self):
+        access_token = self._get_access_token(self.developer1.username, "dev")
+        shipment = ShipmentFactory(owner=self.developer1, tracking_id="1")
+        ShipmentDocument.objects.create(shipment=shipment, document="document/1.jpg")
+        queries_for_one, _ = self._count_list_queries(access_token)
+
+        for tracking_id in range(2, 7):
+            shipment = ShipmentFactory(owner=self.developer1, tracking_id=str(tracking_id))
+            ShipmentDocument.objects.create(shipment=shipment, document="document/1.jpg")
+            ShipmentDocument.objects.create(shipment=shipment, document="document/2.jpg")
+        queries_for_many, results = self._count_list_queries(access_token)
+
+        self.assertEquals(queries_for_one, queries_for_many)
+        self.assertEquals(11, sum(len(shipment['documents']) for shipment in results))
+
+    def test_shipment_list_can_skip_documents(self):
+        access_token = self._get_access_token(self.developer1.username, "dev")
+        shipment = ShipmentFactory(owner=self.developer1, tracking_id="1")
+        ShipmentDocument.objects.create(shipment=shipment, document="document/1.jpg")
+        queries_with_documents, _ = self._count_list_queries(access_token)
+
+        queries, results = self._count_list_queries(access_token, "?fields=tracking_id,state")
+
+        self.assertEquals(queries_with_documents - 1, queries)
+        self.assertEquals([{'tracking_id': '1', 'state': 'PENDING'}], results)
+
+    def _list_tracking_ids(self, access_token, query):
+        response = self.client.get(
+            f'/api/v1/shipments/{query}',
+            content_type='application/json',
+            HTTP_AUTHORIZATION=f"Bearer {access_token}",
+        )
+        self.assertEquals(200, response.status_code)
+        return sorted(shipment['tracking_id'] for shipment in response.json()['results'])
+
+    def test_shipment_list_filters(self):
+        ShipmentFactory(owner=self.developer1, tracking_id="1", receiver_country="EG", driver=self.driver,
+                        scheduled_at=datetime.date(2020, 5, 1), state=Shipment.SCHEDULED)
+        ShipmentFactory(owner=self.developer1, tracking_id="2", receiver_country="SA",
+                        scheduled_at=datetime.date(2020, 5, 10), state=Shipment.SCHEDULED)
+        ShipmentFactory(owner=self.developer1, tracking_id="3", receiver_country="EG")
+        access_token = self._get_access_token(self.developer1.username, "dev")
+
+        self.assertEquals(['1', '2'], self._list_tracking_ids(access_token, "?state=scheduled"))
+        self.assertEquals(['1', '3'], self._list_tracking_ids(access_token, "?receiver_country=EG"))
+        self.assertEquals(['1'], self._list_tracking_ids(access_token, f"?driver={self.driver.id}"))
+        self.assertEquals(['2'], self._list_tracking_ids(access_token, "?scheduled_at_after=2020-05-02"))
+        self.assertEquals(['1'],
+                          self._list_tracking_ids(access_token, "?receiver_country=EG&state=SCHEDULED"))
 
-    def test_admin_can_assign_diver_to_shipment(self):
+    def test_shipment_list_search(self):
+        ShipmentFactory(owner=self.developer1, tracking_id="1", title="Blue shoes", receiver_name="Alaa")
+        ShipmentFactory(owner=self.developer1, tracking_id="2", title="Red hat", receiver_name="Omar")
+        ShipmentFactory(owner=self.developer2, tracking_id="3", title="Blue hat", receiver_name="Alaa")
+        access_token = self._get_access_token(self.developer1.username, "dev")
+
+        self.assertEquals(['1'], self._list_tracking_ids(access_token, "?search=blue"))
+        self.assertEquals(['2'], self._list_tracking_ids(access_token, "?search=ha"))
+        self.assertEquals(['1'], self._list_tracking_ids(access_token, "?search=ala"))
+        self.assertEquals(['2'], self._list_tracking_ids(access_token, "?search=omar%20red"))
+
+    def test_shipment_list_rejects_bad_dates(self):
+        access_token = self._get_access_token(self.developer1.username, "dev")
+
+        response = self.client.get(
+            '/api/v1/shipments/?scheduled_at_after=yesterday',
+            content_type='application/json',
+            HTTP_AUTHORIZATION=f"Bearer {access_token}",
+        )
+
+        self.assertEquals(400, response.status_code)
+        self.assertEquals({'scheduled_at_after': 'Not a valid date, use YYYY-MM-DD'}, response.json())
+
+    def _export(self, access_token, query=""):
+        response = self.client.get(
+            f'/api/v1/shipments/export/{query}',
+            HTTP_AUTHORIZATION=f"Bearer {access_token}",
+        )
+        self.assertEquals(200, response.status_code)
+        return response, b"".join(response.streaming_content)
+
+    def test_developer_can_export_his_shipments_as_csv(self):
+        ShipmentFactory(owner=self.developer1, tracking_id="1", title="Blue shoes", lat=30.5, lon=31.25)
+        ShipmentFactory(owner=self.developer1, tracking_id="2", state=Shipment.SCHEDULED)
+        ShipmentFactory(owner=self.developer2, tracking_id="3")
+        access_token = self._get_access_token(self.developer1.username, "dev")
+
+        response, content = self._export(access_token)
+
+        self.assertEquals('text/csv', response['Content-Type'])
+        self.assertEquals('attachment; filename="shipments.csv"', response['Content-Disposition'])
+        rows = list(csv.DictReader(io.StringIO(content.decode())))
+        self.assertEquals(['1', '2'], [row['tracking_id'] for row in rows])
+        self.assertEquals(("Blue shoes", "30.50000000", "31.25000000"),
+                          (rows[0]['title'], rows[0]['lat'], rows[0]['lon']))
+
+        response, content = self._export(access_token, "?state=scheduled")
+        rows = csv.DictReader(io.StringIO(content.decode()))
+        self.assertEquals(['2'], [row['tracking_id'] for row in rows])
+
+    def test_developer_can_export_his_shipments_as_json_lines(self):
+        ShipmentFactory(owner=self.developer1, tracking_id="1", title="Blue shoes")
+        access_token = self._get_access_token(self.developer1.username, "dev")
+
+        response, content = self._export(access_token, "?format=jsonl")
+
+        self.assertEquals('application/x-ndjson', response['Content-Type'])
+        rows = [json.loads(line) for line in content.splitlines()]
+        self.assertEquals(1, len(rows))
+        self.assertEquals(("1", "Blue shoes", "PENDING"),
+                          (rows[0]['tracking_id'], rows[0]['title'], rows[0]['state']))
+
+    def test_export_as_parquet_writes_a_row_group_per_chunk(self):
+        for tracking_id in range(5):
+            ShipmentFactory(owner=self.developer1, tracking_id=str(tracking_id), lat=30.5)
+        access_token = self._get_access_token(self.developer1.username, "dev")
+
+        with mock.patch("shipment.views.export_rows",
+                        side_effect=lambda shipments: export_rows(shipments, chunk_size=2)):
+            response, content = self._export(access_token, "?format=parquet")
+
+        self.assertEquals('application/vnd.apache.parquet', response['Content-Type'])
+        parquet = pq.ParquetFile(io.BytesIO(content))
+        self.assertEquals(3, parquet.num_row_groups)
+        table = parquet.read()
+        self.assertEquals(['0', '1', '2', '3', '4'], table.column('tracking_id').to_pylist())
+        self.assertEquals(decimal.Decimal('30.5'), table.column('lat').to_pylist()[0])
+
+    def test_export_is_aborted_when_reading_fails(self):
+        ShipmentFactory(owner=self.developer1, tracking_id="1")
+        access_token = self._get_access_token(self.developer1.username, "dev")
+
+        def failing_rows(shipments):
+            yield from export_rows(shipments)
+            raise DatabaseError("connection lost")
+
+        with mock.patch("shipment.views.export_rows", side_effect=failing_rows):
+            response = self.client.get(
+                '/api/v1/shipments/export/',
+                HTTP_AUTHORIZATION=f"Bearer {access_token}",
+            )
+            with self.assertRaises(DatabaseError):
+                b"".join(response.streaming_content)
+
+    def test_shipment_export_rejects_bad_filters(self):
+        access_token = self._get_access_token(self.developer1.username, "dev")
+
+        response = self.client.get(
+            '/api/v1/shipments/export/?driver=me',
+            HTTP_AUTHORIZATION=f"Bearer {access_token}",
+        )
+
+        self.assertEquals(400, response.status_code)
+        self.assertEquals({'driver': 'Not a valid driver id'}, response.json())
+
+    @mock.patch("shipment.models.Event.publish")
+    def test_admin_can_assign_diver_to_shipment(self, event_publish_mock):
         shipment = ShipmentFactory(owner=self.developer1)
         access_token = self._get_access_token("zid", "zid")
         self.client.post(
@@ -164,6 +480,8 @@ class ShipmentTests(TestCase):
 
         shipment.refresh_from_db()
         self.assertEquals(self.driver, shipment.driver)
+        event_publish_mock.assert_called_once_with("SHIPMENT_DRIVER_ASSIGNED", self.developer1.id,
+                                                   {**shipment.to_dict(), "driver_id": self.driver.id})
 
     def test_error_if_assign_developer_to_shipment(self):
         shipment = ShipmentFactory(owner=self.developer1)
@@ -193,8 +511,8 @@ class ShipmentTests(TestCase):
         self.assertEquals(404, response.status_code)
         self.assertEquals({'success': False, 'error': 'Can not find driver with this id'}, response.json())
 
-    @mock.patch("shipment.models.Event.dispatch")
-    def test_driver_can_update_the_state_of_a_shipment(self, event_dispatch_mock):
+    @mock.patch("shipment.models.Event.publish")
+    def test_driver_can_update_the_state_of_a_shipment(self, event_publish_mock):
         shipment = ShipmentFactory(state='SCHEDULED', driver=self.driver)
         access_token = self._get_access_token(self.driver.username, "driver")
         response = self.client.post(
@@ -207,8 +525,47 @@ class ShipmentTests(TestCase):
         self.assertEquals(Shipment.PREPARED, shipment.state)
         self.assertEquals(200, response.status_code)
         self.assertEquals({"success": True}, response.json())
-        event_dispatch_mock.assert_called_with("SHIPMENT_STATE_CHANGED", shipment.owner_id,
-                                               shipment.to_dict())
+        event_publish_mock.assert_called_with("SHIPMENT_STATE_CHANGED", shipment.owner_id,
+                                              shipment.to_dict())
+
+    @mock.patch("shipment.models.Event.publish_many")
+    def test_driver_can_update_the_state_of_many_shipments(self, publish_many_mock):
+        first = ShipmentFactory(state=Shipment.PREPARED, driver=self.driver, tracking_id="1")
+        second = ShipmentFactory(state=Shipment.PREPARED, driver=self.driver, tracking_id="2")
+        ShipmentFactory(state=Shipment.PENDING, driver=self.driver, tracking_id="3")
+        ShipmentFactory(state=Shipment.PREPARED, tracking_id="4")
+        access_token = self._get_access_token(self.driver.username, "driver")
+
+        response = self.client.post(
+            '/api/v1/shipments/update_states/',
+            data=json.dumps({"states": {
+                "1": "delivered",
+                "2": "DELIVERED",
+                "3": "DELIVERED",
+                "4": "DELIVERED",
+            }}),
+            content_type='application/json',
+            HTTP_AUTHORIZATION=f"Bearer {access_token}",
+        )
+
+        self.assertEquals(200, response.status_code)
+        self.assertEquals(
+            {
+                '1': {'success': True},
+                '2': {'success': True},
+                '3': {'success': False, 'error': 'Cannot change state from PENDING to DELIVERED'},
+                '4': {'success': False, 'error': 'Can not find shipment with this tracking id'},
+            }, response.json())
+
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEquals(Shipment.DELIVERED, first.state)
+        self.assertEquals(Shipment.PREPARED, Shipment.objects.get(tracking_id="4").state)
+        publish_many_mock.assert_called_once()
+        event_name, notifications = publish_many_mock.call_args[0]
+        self.assertEquals("SHIPMENT_STATE_CHANGED", event_name)
+        self.assertCountEqual([(first.owner_id, first.to_dict()), (second.owner_id, second.to_dict())],
+                              notifications)
 
     def test_driver_can_not_update_the_state_shipments_in_PENDING_state(self):
         shipment = ShipmentFactory(driver=self.driver)
@@ -238,8 +595,10 @@ class ShipmentTests(TestCase):
         )
         self.assertEquals(403, response.status_code)
 
-    @mock.patch("shipment.models.Shipment.estimate_delivery_date", return_value="2020-09-09")
-    def test_developer_can_schedule_shipments(self, delivery_estimation_mock):
+    @mock.patch("shipment.models.Event.publish")
+    @mock.patch("shipment.models.Shipment.estimate_delivery_date",
+                return_value=datetime.datetime(2020, 9, 9))
+    def test_developer_can_schedule_shipments(self, delivery_estimation_mock, event_publish_mock):
         shipment = ShipmentFactory(owner=self.developer1)
         access_token = self._get_access_token(self.developer1.username, "dev")
         response = self.client.post(
@@ -255,8 +614,101 @@ class ShipmentTests(TestCase):
         self.assertEquals("2020-09-09", str(shipment.estimated_shipping_date))
         self.assertEquals(200, response.status_code)
         self.assertEquals({'estimated_shipping_date': '2020-09-09', 'success': True}, response.json())
+        self.assertEquals(["SHIPMENT_SCHEDULED", "SHIPMENT_ETA_CHANGED"],
+                          [call[0][0] for call in event_publish_mock.call_args_list])
+        # the dates are sent as they are stored, the first estimate changes the ETA from none
+        scheduled, eta_changed = [
+            delivery.deserialize(delivery.serialize(event_name, payload))
+            for (event_name, _, payload), _ in event_publish_mock.call_args_list
+        ]
+        self.assertEquals(("2020-09-09", str(datetime.date.today())),
+                          (scheduled["estimated_shipping_date"], scheduled["scheduled_at"]))
+        self.assertEquals((shipment.tracking_id, "2020-09-09", None),
+                          (eta_changed["tracking_id"], eta_changed["estimated_shipping_date"],
+                           eta_changed["previous_estimated_shipping_date"]))
+
+    @mock.patch("shipment.models.Event.publish_many")
+    @mock.patch("shipment.models.predict_many")
+    def test_developer_can_schedule_shipments_in_bulk(self, prediction_mock, publish_many_mock):
+        prediction_mock.side_effect = lambda distances, load: (np.full(len(distances), 3.0), "abc123")
+        ShipmentFactory(owner=self.developer1, tracking_id="1")
+        ShipmentFactory(owner=self.developer1, tracking_id="2")
+        ShipmentFactory(owner=self.developer1, tracking_id="3", state=Shipment.SCHEDULED)
+        access_token = self._get_access_token(self.developer1.username, "dev")
+
+        with freeze_time('2020-05-01'):
+            response = self.client.post(
+                '/api/v1/shipments/schedule_bulk/',
+                data=json.dumps({"tracking_ids": ["1", "2", "3", "4"]}),
+                content_type='application/json',
+                HTTP_AUTHORIZATION=f"Bearer {access_token}",
+            )
+
+        self.assertEquals(200, response.status_code)
+        self.assertEquals(
+            {
+                '1': {'success': True, 'estimated_shipping_date': '2020-05-04'},
+                '2': {'success': True, 'estimated_shipping_date': '2020-05-04'},
+                '3': {'success': False, 'error': 'Cannot change state from SCHEDULED to SCHEDULED'},
+                '4': {'success': False, 'error': 'Can not find shipment with this tracking id'},
+            }, response.json())
+        prediction_mock.assert_called_once()
+
+        shipment = Shipment.objects.get(tracking_id="1")
+        self.assertEquals(Shipment.SCHEDULED, shipment.state)
+        self.assertEquals(datetime.date(2020, 5, 4), shipment.estimated_shipping_date)
+        self.assertEquals("abc123", shipment.estimation_model_version)
+        self.assertEquals(
+            [("SHIPMENT_SCHEDULED", ["1", "2"]), ("SHIPMENT_ETA_CHANGED", ["1", "2"])],
+            [(event_name, sorted(payload["tracking_id"] for _, payload in notifications))
+             for (event_name, notifications), _ in publish_many_mock.call_args_list])
+        # the dates are sent as they are stored
+        _, [(_, payload), _] = publish_many_mock.call_args[0]
+        self.assertEquals(("2020-05-04", "2020-05-01", None),
+                          (str(payload["estimated_shipping_date"]), str(payload["scheduled_at"]),
+                           payload["previous_estimated_shipping_date"]))
+
+    @mock.patch("shipment.models.transaction.on_commit", side_effect=lambda func: func())
+    @mock.patch("shipment.models.prerender_labels.delay")
+    @mock.patch("shipment.models.Shipment.estimate_delivery_date",
+                return_value=datetime.datetime(2020, 9, 9))
+    def test_scheduling_prerenders_the_label(self, delivery_estimation_mock, prerender_mock, on_commit_mock):
+        shipment = ShipmentFactory(owner=self.developer1)
+
+        shipment.schedule()
+
+        prerender_mock.assert_called_once_with([shipment.tracking_id])
 
-    def test_developer_can_attach_documents(self):
+    @mock.patch("shipment.models.transaction.on_commit", side_effect=lambda func: func())
+    @mock.patch("shipment.models.prerender_labels.delay", side_effect=ConnectionError("broker is down"))
+    @mock.patch("shipment.models.Shipment.estimate_delivery_date",
+                return_value=datetime.datetime(2020, 9, 9))
+    def test_scheduling_without_broker(self, delivery_estimation_mock, prerender_mock, on_commit_mock):
+        shipment = ShipmentFactory(owner=self.developer1)
+        access_token = self._get_access_token(self.developer1.username, "dev")
+
+        response = self.client.post(
+            f'/api/v1/shipments/{shipment.tracking_id}/schedule/',
+            content_type='application/json',
+            HTTP_AUTHORIZATION=f"Bearer {access_token}",
+        )
+
+        prerender_mock.assert_called_once_with([shipment.tracking_id])
+        self.assertEquals(200, response.status_code)
+        shipment.refresh_from_db()
+        self.assertEquals(Shipment.SCHEDULED, shipment.state)
+
+    @mock.patch("shipment.models.Shipment.get_label", autospec=True)
+    def test_prerender_labels_task(self, get_label_mock):
+        ShipmentFactory(owner=self.developer1, tracking_id="1")
+        ShipmentFactory(owner=self.developer1, tracking_id="2")
+
+        prerender_labels(["1", "2", "3"])
+
+        self.assertCountEqual(["1", "2"], [call[0][0].tracking_id for call in get_label_mock.call_args_list])
+
+    @mock.patch("shipment.models.Event.publish")
+    def test_developer_can_attach_documents(self, event_publish_mock):
         shipment = ShipmentFactory(owner=self.developer1)
         access_token = self._get_access_token(self.developer1.username, "dev")
         file1 = SimpleUploadedFile("file1.jpg", b"file_content", content_type="image/jpg")
@@ -271,6 +723,10 @@ class ShipmentTests(TestCase):
         )
         self.assertEquals(201, response.status_code)
         self.assertEquals(3, shipment.documents.count())
+        event_name, owner_id, payload = event_publish_mock.call_args[0]
+        self.assertEquals(("SHIPMENT_DOCUMENTS_ATTACHED", self.developer1.id), (event_name, owner_id))
+        self.assertCountEqual([document.document.name for document in shipment.documents.all()],
+                              payload["documents"])
 
     def test_error_when_attaching_no_documents(self):
         shipment = ShipmentFactory(owner=self.developer1)
@@ -298,13 +754,90 @@ class ShipmentTests(TestCase):
         )
 
         self.assertEquals(200, response.status_code)
-        file = io.BytesIO(response.content)
+        file = io.BytesIO(b"".join(response.streaming_content))
         zp = zipfile.ZipFile(file)
 
         self.assertCountEqual(['1.pdf', '2.pdf'], [x.filename for x in zp.infolist()])
 
+    @mock.patch("shipment.models.Shipment.get_label", autospec=True)
+    def test_print_streams_labels_in_a_zip(self, get_label_mock):
+        get_label_mock.side_effect = lambda shipment: f"label {shipment.tracking_id}".encode()
+        for tracking_id in range(10):
+            ShipmentFactory(owner=self.developer1, tracking_id=str(tracking_id))
+
+        access_token = self._get_access_token(self.developer1.username, "dev")
+        query = "&".join(f"tracking_id={tracking_id}" for tracking_id in range(10))
+
+        response = self.client.get(
+            f'/api/v1/shipments/print/?{query}',
+            content_type='application/json',
+            HTTP_AUTHORIZATION=f"Bearer {access_token}",
+        )
+
+        self.assertEquals(200, response.status_code)
+        self.assertTrue(response.streaming)
+        zp = zipfile.ZipFile(io.BytesIO(b"".join(response.streaming_content)))
+        self.assertEquals(10, len(zp.infolist()))
+        self.assertEquals(b"label 7", zp.read("7.pdf"))
+
+    @mock.patch("shipment.models.Shipment.get_label", autospec=True)
+    def test_print_aborts_the_zip_when_a_label_fails(self, get_label_mock):
+        def get_label(shipment):
+            if shipment.tracking_id == "2":
+                raise OSError("wkhtmltopdf crashed")
+            return f"label {shipment.tracking_id}".encode()
+
+        get_label_mock.side_effect = get_label
+        for tracking_id in range(5):
+            ShipmentFactory(owner=self.developer1, tracking_id=str(tracking_id))
+
+        access_token = self._get_access_token(self.developer1.username, "dev")
+        query = "&".join(f"tracking_id={tracking_id}" for tracking_id in range(5))
+
+        response = self.client.get(
+            f'/api/v1/shipments/print/?{query}',
+            content_type='application/json',
+            HTTP_AUTHORIZATION=f"Bearer {access_token}",
+        )
+
+        self.assertEquals(200, response.status_code)
+        with self.assertRaises(OSError):
+            b"".join(response.streaming_content)
+
+    def test_developer_can_print_labels_in_one_pdf(self):
+        ShipmentFactory(owner=self.developer1, tracking_id="1")
+        ShipmentFactory(owner=self.developer1, tracking_id="2")
+        ShipmentFactory(owner=self.developer2, tracking_id="3")
+
+        access_token = self._get_access_token(self.developer1.username, "dev")
+
+        response = self.client.get(
+            '/api/v1/shipments/print/?tracking_id=1&tracking_id=2&tracking_id=3&format=pdf',
+            HTTP_AUTHORIZATION=f"Bearer {access_token}",
+        )
+
+        self.assertEquals(200, response.status_code)
+        self.assertEquals('application/pdf', response['Content-Type'])
+        document = b"".join(response.streaming_content)
+        self.assertTrue(document.startswith(b"%PDF-1.4"))
+        self.assertIn(b"/Count 2", document)
+        self.assertIn(b"(Tracking Id is 1) Tj", document)
+        self.assertIn(b"(Tracking Id is 2) Tj", document)
+
+    def test_print_errors_are_json_for_pdf_format(self):
+        access_token = self._get_access_token(self.developer1.username, "dev")
+
+        response = self.client.get(
+            '/api/v1/shipments/print/?format=pdf',
+            HTTP_AUTHORIZATION=f"Bearer {access_token}",
+        )
+
+        self.assertEquals(500, response.status_code)
+        self.assertEquals('application/json', response['Content-Type'])
+        self.assertEquals({"error": "error happened please try again later"}, response.json())
+
     @freeze_time('2020-05-01')
-    @mock.patch("shipment.models.predict", return_value=3.5)
+    @mock.patch("shipment.models.predict_with_version", return_value=(3.5, "abc123"))
     def test_estimate_delivery_date(self, perdiction_mock):
         ShipmentFactory(owner=self.developer1, tracking_id="1")
         access_token = self._get_access_token(self.developer1.username, "dev")
@@ -315,4 +848,276 @@ class ShipmentTests(TestCase):
             HTTP_AUTHORIZATION=f"Bearer {access_token}",
         )
         self.assertEquals(200, response.status_code)
-        self.assertEquals({'date': '2020-05-05T00:00:00'}, response.json())
+        self.assertEquals({'date': '2020-05-05T00:00:00', 'model_version': 'abc123'}, response.json())
+
+    @freeze_time('2020-05-01')
+    @mock.patch("shipment.models.predict_many")
+    def test_estimate_delivery_dates_in_bulk(self, prediction_mock):
+        prediction_mock.side_effect = lambda distances, load: (np.full(len(distances), 2.4), "abc123")
+        ShipmentFactory(owner=self.developer1, tracking_id="1")
+        ShipmentFactory(owner=self.developer1, tracking_id="2")
+        ShipmentFactory(owner=self.developer2, tracking_id="3")
+        access_token = self._get_access_token(self.developer1.username, "dev")
+
+        response = self.client.post(
+            '/api/v1/shipments/estimate_delivery_dates/',
+            data=json.dumps({"tracking_ids": ["1", "2", "3"]}),
+            content_type='application/json',
+            HTTP_AUTHORIZATION=f"Bearer {access_token}",
+        )
+        self.assertEquals(200, response.status_code)
+        lines = [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+
+        prediction_mock.assert_called_once()
+        self.assertCountEqual([
+            {'tracking_id': '1', 'date': '2020-05-03T00:00:00', 'model_version': 'abc123'},
+            {'tracking_id': '2', 'date': '2020-05-03T00:00:00', 'model_version': 'abc123'},
+            {'tracking_id': '3', 'error': 'Can not find shipment with this tracking id'},
+        ], lines)
+
+    @mock.patch("shipment.models.predict_many")
+    def test_estimate_many_predicts_once_per_chunk(self, prediction_mock):
+        prediction_mock.side_effect = lambda distances, load: (np.full(len(distances), 1.0), "abc123")
+        for tracking_id in range(5):
+            ShipmentFactory(owner=self.developer1, tracking_id=str(tracking_id))
+
+        estimates = list(Shipment.objects.filter(owner=self.developer1).estimate_many(chunk_size=2))
+
+        self.assertEquals(5, len(estimates))
+        self.assertEquals(3, prediction_mock.call_count)
+
+
+class ModelRegistryTests(TestCase):
+    """Testing the in memory estimation model registry"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.file_name = os.path.join(self.directory, 'model.sav')
+        self._save_model(2.0)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _save_model(self, intercept):
+        model = LinearRegression()
+        model.fit([[0, 0], [1, 0], [0, 1]], [intercept, intercept, intercept])
+        with open(self.file_name, 'wb') as f:
+            pickle.dump(model, f)
+
+    def test_model_is_loaded_once(self):
+        registry = ModelRegistry(self.file_name, check_interval=0)
+
+        with mock.patch("shipment.estimation_model.pickle.loads", wraps=pickle.loads) as loads_mock:
+            first = registry.get()
+            second = registry.get()
+
+        self.assertIs(first, second)
+        self.assertEquals(1, loads_mock.call_count)
+
+    def test_model_is_reloaded_when_file_changes(self):
+        registry = ModelRegistry(self.file_name, check_interval=0)
+        old = registry.get()
+
+        self._save_model(7.0)
+        os.utime(self.file_name, (old.mtime + 10, old.mtime + 10))
+        new = registry.get()
+
+        self.assertNotEquals(old.version, new.version)
+        self.assertAlmostEqual(7.0, new.model.predict([[1, 1]])[0])
+
+    @override_settings(ESTIMATION_MODEL_CHECK_INTERVAL=3600)
+    def test_model_file_is_checked_every_interval(self):
+        registry = ModelRegistry(self.file_name)
+        old = registry.get()
+
+        self._save_model(7.0)
+        os.utime(self.file_name, (old.mtime + 10, old.mtime + 10))
+
+        self.assertIs(old, registry.get())
+
+    def test_broken_model_file_keeps_the_old_model(self):
+        registry = ModelRegistry(self.file_name, check_interval=0)
+        old = registry.get()
+
+        with open(self.file_name, 'wb') as f:
+            f.write(b"not a model")
+        os.utime(self.file_name, (old.mtime + 10, old.mtime + 10))
+
+        self.assertEquals(old.version, registry.get().version)
+
+
+class DistanceTests(TestCase):
+    """Testing the vectorized distance methods against geopy"""
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.lats = rng.uniform(-80, 80, 100)
+        self.lons = rng.uniform(-180, 180, 100)
+        self.reference = np.array([
+            geopy_distance.distance((30.05, 31.15), (lat, lon)).km for lat, lon in zip(self.lats, self.lons)
+        ])
+
+    def test_geodesic_matches_geopy(self):
+        result = distance.geodesic(30.05, 31.15, self.lats, self.lons)
+        np.testing.assert_allclose(result, self.reference, atol=1e-6)
+
+    def test_haversine_is_close_to_geopy(self):
+        result = distance.haversine(30.05, 31.15, self.lats, self.lons)
+        np.testing.assert_allclose(result, self.reference, rtol=5e-3)
+
+    def test_same_point_has_zero_distance(self):
+        self.assertEquals(0, distance.geodesic(30.05, 31.15, 30.05, 31.15))
+
+    def test_unknown_method(self):
+        with self.assertRaises(ValueError):
+            distance.distance(0, 0, 1, 1, method="manhattan")
+
+
+class LabelRenderingTests(TestCase):
+    """Testing the parallel label rendering"""
+
+    def test_labels_are_rendered_in_order_with_bounded_read_ahead(self):
+        consumed = []
+
+        def shipments():
+            for index in range(20):
+                consumed.append(index)
+                shipment = mock.Mock(tracking_id=str(index))
+                shipment.get_label.return_value = f"label {index}".encode()
+                yield shipment
+
+        rendered = render_labels(shipments(), workers=2)
+        for index, (shipment, label) in enumerate(rendered):
+            self.assertEquals(str(index), shipment.tracking_id)
+            self.assertEquals(f"label {index}".encode(), label)
+            self.assertLessEqual(len(consumed), index + 1 + 4)
+
+        self.assertEquals(20, len(consumed))
+
+    def test_zip_stream(self):
+        chunks = list(zip_stream((f"{index}.pdf", b"label") for index in range(3)))
+
+        self.assertGreater(len(chunks), 3)
+        zp = zipfile.ZipFile(io.BytesIO(b"".join(chunks)))
+        self.assertEquals(['0.pdf', '1.pdf', '2.pdf'], zp.namelist())
+
+
+class LabelCacheTests(TestCase):
+    """Testing the label cache"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.settings = override_settings(LABEL_CACHE={
+            'BACKEND': 'shipment.labels.FileSystemLabelStore',
+            'OPTIONS': {
+                'directory': self.directory,
+                'max_size': 100,
+            },
+        })
+        self.settings.enable()
+
+    def tearDown(self):
+        self.settings.disable()
+        shutil.rmtree(self.directory)
+
+    @mock.patch("shipment.labels.render_label", return_value=b"pdf")
+    def test_label_is_rendered_once(self, render_mock):
+        shipment = ShipmentFactory(tracking_id="1")
+
+        self.assertEquals(b"pdf", shipment.get_label())
+        self.assertEquals(b"pdf", shipment.get_label())
+        self.assertEquals(1, render_mock.call_count)
+
+    @mock.patch("shipment.labels.render_label", return_value=b"pdf")
+    def test_label_is_invalidated_when_shipment_is_saved(self, render_mock):
+        shipment = ShipmentFactory(tracking_id="1")
+        shipment.get_label()
+
+        shipment.save()
+        self.assertEquals([], os.listdir(self.directory))
+
+        shipment.get_label()
+        self.assertEquals(2, render_mock.call_count)
+
+    def test_least_recently_used_labels_are_evicted(self):
+        store = get_label_store()
+        store.set("1", "a", b"x" * 40)
+        store.set("2", "b", b"x" * 40)
+        os.utime(os.path.join(self.directory, "1", "a.pdf"), (0, 0))
+        store.set("3", "c", b"x" * 40)
+
+        self.assertIsNone(store.get("1", "a"))
+        self.assertEquals(b"x" * 40, store.get("2", "b"))
+        self.assertEquals(b"x" * 40, store.get("3", "c"))
+
+    def test_deleting_labels_frees_their_size(self):
+        store = get_label_store()
+        store.set("1", "a", b"x" * 40)
+        store.set("1", "b", b"x" * 40)
+        store.set("2", "c", b"x" * 10)
+
+        store.delete("1")
+        store.set("3", "d", b"x" * 40)
+
+        self.assertEquals(["2", "3"], sorted(os.listdir(self.directory)))
+        self.assertEquals(50, store._size)
+        self.assertEquals(b"x" * 10, store.get("2", "c"))
+
+    def test_django_cache_store_checks_the_digest(self):
+        store = DjangoCacheLabelStore()
+        store.set("1", "a", b"pdf")
+
+        self.assertEquals(b"pdf", store.get("1", "a"))
+        self.assertIsNone(store.get("1", "b"))
+
+        store.delete("1")
+        self.assertIsNone(store.get("1", "a"))
+
+
+class LabelRendererTests(TestCase):
+    """Testing the label renderers"""
+
+    context = {
+        "title": "Test (shipment)",
+        "receiver_name": "alaa",
+        "receiver_country": "EG",
+        "receiver_address": "Cairo",
+        "weight": 1.5,
+        "tracking_id": "123",
+    }
+
+    def test_native_renderer_draws_the_label_fields(self):
+        label = NativeLabelRenderer().render(self.context)
+
+        self.assertTrue(label.startswith(b"%PDF-1.4"))
+        self.assertTrue(label.endswith(b"%%EOF\n"))
+        self.assertIn(b"(Test \\(shipment\\)) Tj", label)
+        self.assertIn(b"(receiver name is alaa) Tj", label)
+        self.assertIn(b"/Count 1", label)
+
+    @mock.patch("shipment.labels.WkhtmltopdfLabelRenderer.render", return_value=b"wkhtmltopdf")
+    def test_unsupported_text_falls_back_to_wkhtmltopdf(self, wkhtmltopdf_mock):
+        self.assertNotEqual(b"wkhtmltopdf", render_label(self.context))
+
+        context = dict(self.context, receiver_name="علاء")
+        self.assertEquals(b"wkhtmltopdf", render_label(context))
+        wkhtmltopdf_mock.assert_called_once_with(context)
+
+    @mock.patch("shipment.labels.WkhtmltopdfLabelRenderer.render")
+    def test_document_labels_with_unsupported_text_are_rendered_by_wkhtmltopdf(self, wkhtmltopdf_mock):
+        # any pdf document stands for the wkhtmltopdf one, the standard fonts draw the arabic name as `?`
+        writer_output = io.BytesIO()
+        writer = PdfWriter(writer_output, strict=False)
+        writer.add_page([(pdf.REGULAR, 12, "receiver name is علاء")])
+        writer.close()
+        wkhtmltopdf_mock.return_value = writer_output.getvalue()
+        contexts = [self.context, dict(self.context, receiver_name="علاء"), self.context]
+
+        document = b"".join(NativeLabelRenderer().render_document(iter(contexts)))
+
+        wkhtmltopdf_mock.assert_called_once_with(contexts[1])
+        pages = PdfReader(io.BytesIO(document)).pages
+        self.assertEquals(3, len(pages))
+        self.assertIn("receiver name is alaa", pages[0].extract_text())
+        self.assertIn("receiver name is ????", pages[1].extract_text())
+        self.assertIn("receiver name is alaa", pages[2].extract_text())
@@ -1,14 +1,14 @@
-import io
-import zipfile
 import logging
 from django.core.exceptions import ValidationError
+from django.db import transaction
 
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework.parsers import MultiPartParser
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
-from django.http import HttpResponse
+from django.http import StreamingHttpResponse
 from .custom_permissions import (
     CanAttachDocument,
     CanCreateShipment,
@@ -17,7 +17,14 @@ from .custom_permissions import (
     CanScheduleShipment,
 )
 from .serializers import ShipmentSerializer
-from .models import Shipment, ShipmentDocument
+from .exports import WRITERS, export_rows
+from .filters import filter_shipments
+from .imports import FORMATS, READERS, import_shipments
+from .labels import get_renderer, render_labels
+from .pagination import ShipmentCursorPagination
+from .renderers import CSVRenderer, JSONLinesRenderer, ParquetRenderer, PDFRenderer, ZipRenderer
+from .streaming import ndjson_response, zip_stream
+from .models import Shipment
 from profiles.models import User
 
 logger = logging.getLogger(__name__)
@@ -31,11 +38,33 @@ class ShipmentResource(viewsets.ModelViewSet):
         'delete': (IsAdminUser, ),
     }
     serializer_class = ShipmentSerializer
+    pagination_class = ShipmentCursorPagination
     queryset = Shipment.objects.all()
     lookup_field = 'tracking_id'
 
     def get_queryset(self):
-        return self.request.user.profile.get_all_shipments()
+        shipments = self.request.user.profile.get_all_shipments()
+
+        if self.action in ('list', 'export'):
+            shipments = filter_shipments(shipments, self.request.query_params)
+
+        if self.action in ('list', 'retrieve'):
+            fields = self.get_requested_fields()
+            if fields is None or 'documents' in fields:
+                shipments = shipments.prefetch_related('documents')
+
+        return shipments
+
+    def get_requested_fields(self):
+        """Return the fields asked for with `?fields=title,state`, None for all the fields"""
+
+        fields = self.request.query_params.get('fields')
+        return fields.split(',') if fields else None
+
+    def get_serializer(self, *args, **kwargs):
+        if self.action in ('list', 'retrieve'):
+            kwargs.setdefault('fields', self.get_requested_fields())
+        return super().get_serializer(*args, **kwargs)
 
     def get_permissions(self):
         try:
@@ -59,6 +88,59 @@ class ShipmentResource(viewsets.ModelViewSet):
             return Response({"error": "error happened please try again later"},
                             status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+    @action(detail=False,
+            methods=['get'],
+            permission_classes=(IsAuthenticated, ),
+            renderer_classes=(CSVRenderer, JSONLinesRenderer, ParquetRenderer))
+    def export(self, request):
+        """
+        Export the Shipments as csv (the default), `format=jsonl` or `format=parquet`, the list filters apply.
+        The rows are read with a server side cursor and the file is streamed while they are read.
+        """
+
+        file_format = request.accepted_renderer.format
+        chunks = export_rows(self.get_queryset().order_by('id'))
+
+        def content():
+            # in a transaction postgres reads the rows with a plain cursor instead of a WITH HOLD one,
+            # an error is raised again to cut the download rather than end a truncated file
+            try:
+                with transaction.atomic():
+                    yield from WRITERS[file_format](chunks)
+            except Exception as e:
+                logger.exception(f"Error {e} while exporting shipments")
+                raise
+
+        res = StreamingHttpResponse(content(), content_type=request.accepted_renderer.media_type)
+        res['Content-Disposition'] = f'attachment; filename="shipments.{file_format}"'
+        return res
+
+    @action(detail=False, methods=['post'], permission_classes=(CanCreateShipment, ), url_path='import')
+    def import_shipments(self, request):
+        """
+        Create many Shipments from a csv or json lines file sent as the request body.
+        The file is read while it is uploaded and the result of every row is streamed back as json lines.
+        """
+
+        content_type = request.content_type.split(';')[0].strip().lower()
+        if content_type not in FORMATS:
+            return Response({"error": f"The file should be one of {', '.join(FORMATS)}"},
+                            status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+
+        if request.stream is None:
+            return Response({"error": "You should provide the shipments"}, status=status.HTTP_400_BAD_REQUEST)
+
+        rows = READERS[FORMATS[content_type]](request.stream)
+
+        def results():
+            try:
+                yield from import_shipments(rows, request.user)
+            except Exception as e:
+                logger.exception(f"Error {e} while importing shipments")
+                yield {"error": "error happened please try again later"}
+
+        return ndjson_response(results())
+
     @action(detail=False, methods=['post'], permission_classes=(IsAdminUser, ), url_path='(?P<tracking_id>[^/.]+)/assign_driver/(?P<driver_id>[^/.]+)') # noqa
     def assign_driver(self, request, tracking_id, driver_id):
         """Assign a Driver to a Shipment"""
@@ -69,8 +151,7 @@ class ShipmentResource(viewsets.ModelViewSet):
             assert driver.role == User.DRIVER, "You should assign user of type `DRIVER`"
 
             shipment = self.get_object()
-            shipment.driver = driver
-            shipment.save()
+            shipment.assign_driver(driver)
             return Response({'success': True}, status=status.HTTP_200_OK)
 
         except AssertionError as e:
@@ -102,6 +183,35 @@ class ShipmentResource(viewsets.ModelViewSet):
             return Response({"success": False, "error": "error happened please try again later"},
                             status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+    @action(detail=False, methods=['post'], permission_classes=(CanChangeShipmentState, ))
+    def update_states(self, request):
+        """Change the state of many Shipments at once, each one is reported on its own"""
+
+        try:
+            states = request.data.get("states", {})
+            assert states and isinstance(states, dict), "You should provide states"
+            assert all(isinstance(state, str) for state in states.values()), "states should be strings"
+
+            updated, errors = self.get_queryset().update_states(states)
+            results = {shipment.tracking_id: {"success": True} for shipment in updated}
+            for tracking_id, error in errors.items():
+                results[tracking_id] = {"success": False, "error": error}
+            for tracking_id in states:
+                results.setdefault(tracking_id, {
+                    "success": False,
+                    "error": "Can not find shipment with this tracking id"
+                })
+
+            return Response(results, status=status.HTTP_200_OK)
+
+        except AssertionError as e:
+            return Response({"success": False, "error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        except Exception as e:
+            logger.exception(f"Error {e} while updating shipments states in bulk")
+            return Response({"success": False, "error": "error happened please try again later"},
+                            status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
     @action(detail=True, methods=['post'], permission_classes=(CanScheduleShipment, ))
     def schedule(self, request, tracking_id=None):
         """Schedule a Shipment"""
@@ -120,6 +230,40 @@ class ShipmentResource(viewsets.ModelViewSet):
             return Response({"success": False, "error": "error happened please try again later"},
                             status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+    @action(detail=False, methods=['post'], permission_classes=(CanScheduleShipment, ))
+    def schedule_bulk(self, request):
+        """Schedule many Shipments at once, each one is reported on its own"""
+
+        try:
+            tracking_ids = request.data.get("tracking_ids", [])
+            assert tracking_ids and isinstance(tracking_ids, list), "You should provide tracking_ids"
+
+            scheduled, errors = self.get_queryset().filter(tracking_id__in=tracking_ids).schedule_bulk()
+            results = {
+                shipment.tracking_id: {
+                    "success": True,
+                    "estimated_shipping_date": shipment.estimated_shipping_date
+                }
+                for shipment in scheduled
+            }
+            for tracking_id, error in errors.items():
+                results[tracking_id] = {"success": False, "error": error}
+            for tracking_id in tracking_ids:
+                results.setdefault(tracking_id, {
+                    "success": False,
+                    "error": "Can not find shipment with this tracking id"
+                })
+
+            return Response(results, status=status.HTTP_200_OK)
+
+        except AssertionError as e:
+            return Response({"success": False, "error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        except Exception as e:
+            logger.exception(f"Error {e} while scheduling shipments in bulk")
+            return Response({"success": False, "error": "error happened please try again later"},
+                            status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
     @action(detail=True,
             methods=['post'],
             permission_classes=(CanAttachDocument, ),
@@ -130,37 +274,55 @@ class ShipmentResource(viewsets.ModelViewSet):
         if not request.FILES.getlist('documents'):
             return Response({"error": "please attach some documents"}, status=status.HTTP_400_BAD_REQUEST)
 
-        for file in request.FILES.getlist('documents'):
-            ShipmentDocument.objects.create(document=file, shipment=shipment)
+        shipment.attach_documents(request.FILES.getlist('documents'))
 
         data = self.serializer_class(shipment).data
         return Response(data, status=status.HTTP_201_CREATED)
 
-    @action(detail=False, methods=['get'], permission_classes=(CanPrintLabel, ))
+    @action(detail=False,
+            methods=['get'],
+            permission_classes=(CanPrintLabel, ),
+            renderer_classes=(JSONRenderer, ZipRenderer, PDFRenderer))
     def print(self, request):
-        """Print labels for given tracking ids"""
+        """
+        Print labels for given tracking ids, the file is streamed while the labels are rendered.
+        By default it is a zip of one pdf per shipment, `format=pdf` returns one pdf with a page per shipment.
+        """
 
         try:
             tracking_ids = request.GET.getlist("tracking_id", [])
             assert tracking_ids, "You should provide tracking_ids"
             shipments = self.get_queryset()
-            shipments = shipments.filter(tracking_id__in=tracking_ids)
+            shipments = shipments.filter(tracking_id__in=tracking_ids).iterator(chunk_size=100)
 
-            result = io.BytesIO()
-
-            with zipfile.ZipFile(result, 'w') as zf:
-                for shipment in shipments:
-                    label = shipment.get_label()
-                    zf.writestr(f"{shipment.tracking_id}.pdf", label)
+        except Exception as e:
+            logger.exception(f"Error {e} while printing labels")
+            return Response({"error": "error happened please try again later"},
+                            status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-            res = HttpResponse(result.getvalue(), content_type='application/zip')
-            res['Content-Disposition'] = 'attachment; filename="shipment_labels.zip"'
+        if request.accepted_renderer.format == PDFRenderer.format:
+            contexts = (shipment.to_dict() for shipment in shipments)
+            content = self._log_errors(get_renderer().render_document(contexts))
+            res = StreamingHttpResponse(content, content_type='application/pdf')
+            res['Content-Disposition'] = 'attachment; filename="shipment_labels.pdf"'
             return res
 
+        entries = ((f"{shipment.tracking_id}.pdf", label) for shipment, label in render_labels(shipments))
+        res = StreamingHttpResponse(zip_stream(self._log_errors(entries)), content_type='application/zip')
+        res['Content-Disposition'] = 'attachment; filename="shipment_labels.zip"'
+        return res
+
+    def _log_errors(self, iterable):
+        """
+        Log the errors raised while streaming a response. It has already started, so the error is raised
+        again to abort it, the client gets a broken download rather than an incomplete file.
+        """
+
+        try:
+            yield from iterable
         except Exception as e:
             logger.exception(f"Error {e} while printing labels")
-            return Response({"error": "error happened please try again later"},
-                            status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            raise
 
     @action(detail=True, methods=['get'], permission_classes=(CanScheduleShipment, ))
     def estimate_delivery_date(self, request, tracking_id=None):
@@ -169,8 +331,36 @@ class ShipmentResource(viewsets.ModelViewSet):
         try:
             shipment = self.get_object()
             estimated_date = shipment.estimate_delivery_date()
-            return Response({"date": estimated_date}, status=status.HTTP_200_OK)
+            return Response({"date": estimated_date, "model_version": shipment.estimation_model_version},
+                            status=status.HTTP_200_OK)
         except Exception as e:
             logger.exception(f"Error {e} while estimating delivery date")
             return Response({"error": "error happened please try again later"},
                             status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    @action(detail=False, methods=['post'], permission_classes=(CanScheduleShipment, ))
+    def estimate_delivery_dates(self, request):
+        """Calculate the estimated delivery dates for many shipments, streamed as json lines"""
+
+        try:
+            tracking_ids = request.data.get("tracking_ids", [])
+            assert tracking_ids and isinstance(tracking_ids, list), "You should provide tracking_ids"
+            shipments = self.get_queryset().filter(tracking_id__in=tracking_ids)
+        except AssertionError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        def rows():
+            found = set()
+            try:
+                for tracking_id, date, version in shipments.estimate_many():
+                    found.add(tracking_id)
+                    yield {"tracking_id": tracking_id, "date": date, "model_version": version}
+            except Exception as e:
+                logger.exception(f"Error {e} while estimating delivery dates")
+                yield {"error": "error happened please try again later"}
+                return
+
+            for tracking_id in set(tracking_ids) - found:
+                yield {"tracking_id": tracking_id, "error": "Can not find shipment with this tracking id"}
+
+        return ndjson_response(rows())
@@ -167,4 +167,71 @@ CELERY_IGNORE_RESULT = env.str("CELERY_IGNORE_RESULT", False)
 
 
 STORE_LAT = float(os.getenv("STORE_LAT", 30.051408))
-STORE_LON = float(os.getenv("STORE_LON", 31.153276))
\ No newline at end of file
+STORE_LON = float(os.getenv("STORE_LON", 31.153276))
+
+# How often (in seconds) the estimation model file is checked for a new version
+ESTIMATION_MODEL_CHECK_INTERVAL = float(os.getenv("ESTIMATION_MODEL_CHECK_INTERVAL", 5))
+
+# `geodesic` (accurate) or `haversine` (faster) distance between the store and the destinations
+DISTANCE_METHOD = os.getenv("DISTANCE_METHOD", "geodesic")
+
+# Number of labels rendered at the same time while printing
+LABEL_RENDER_WORKERS = int(os.getenv("LABEL_RENDER_WORKERS", 4))
+
+# Where the rendered labels are cached, `shipment.labels.DjangoCacheLabelStore` keeps them in a Django cache.
+# The labels are pre-rendered by the celery workers and printed by the web processes, so the file system
+# store only works when they all share LABEL_CACHE_DIR, on a single host or on a shared volume.
+LABEL_CACHE = {
+    'BACKEND': 'shipment.labels.FileSystemLabelStore',
+    'OPTIONS': {
+        'directory': os.getenv("LABEL_CACHE_DIR", os.path.join(BASE_DIR, 'label_cache')),
+        'max_size': int(os.getenv("LABEL_CACHE_MAX_SIZE", 512 * 1024 * 1024)),
+    },
+}
+
+# `shipment.labels.NativeLabelRenderer` draws labels in process and falls back to
+# `shipment.labels.WkhtmltopdfLabelRenderer` for text it can not draw
+LABEL_RENDERER = os.getenv("LABEL_RENDERER", "shipment.labels.NativeLabelRenderer")
+
+# Seconds to wait for a webhook to accept the connection and to answer
+WEBHOOK_CONNECT_TIMEOUT = float(os.getenv("WEBHOOK_CONNECT_TIMEOUT", 3.05))
+WEBHOOK_READ_TIMEOUT = float(os.getenv("WEBHOOK_READ_TIMEOUT", 10))
+
+# Connections kept alive per webhook host, and the number of hosts whose connections are kept
+WEBHOOK_POOL_MAXSIZE = int(os.getenv("WEBHOOK_POOL_MAXSIZE", 4))
+WEBHOOK_POOL_CONNECTIONS = int(os.getenv("WEBHOOK_POOL_CONNECTIONS", 50))
+
+# `celery` sends every webhook in its own task, `asyncio` sends batches of WEBHOOK_BATCH_SIZE webhooks
+# from one task each, with up to WEBHOOK_ASYNC_CONCURRENCY requests in flight at a time
+WEBHOOK_DISPATCHER = os.getenv("WEBHOOK_DISPATCHER", "celery")
+WEBHOOK_BATCH_SIZE = int(os.getenv("WEBHOOK_BATCH_SIZE", 500))
+WEBHOOK_ASYNC_CONCURRENCY = int(os.getenv("WEBHOOK_ASYNC_CONCURRENCY", 100))
+
+# Seconds before the first retry of a failed webhook, it doubles with every attempt up to the max
+WEBHOOK_RETRY_BACKOFF = float(os.getenv("WEBHOOK_RETRY_BACKOFF", 2))
+WEBHOOK_RETRY_BACKOFF_MAX = float(os.getenv("WEBHOOK_RETRY_BACKOFF_MAX", 600))
+
+# Seconds between the batches of redriven webhooks
+WEBHOOK_REDRIVE_INTERVAL = float(os.getenv("WEBHOOK_REDRIVE_INTERVAL", 1))
+
+# Seconds between two sweeps of the batches whose flush was lost, run by celery beat
+PENDING_NOTIFICATIONS_SWEEP_INTERVAL = float(os.getenv("PENDING_NOTIFICATIONS_SWEEP_INTERVAL", 60))
+CELERY_BEAT_SCHEDULE = {
+    'flush-stale-notifications': {
+        'task': 'eventful.tasks.flush_stale_notifications',
+        'schedule': PENDING_NOTIFICATIONS_SWEEP_INTERVAL,
+    },
+}
+
+# Seconds a process caches the webhook subscriptions it looked up. The changes are seen right away by the
+# processes sharing the default cache, set CACHE_URL to a shared one e.g. rediscache://redis:6379/1
+CACHES = {
+    'default': env.cache_url('CACHE_URL', default='locmemcache://'),
+}
+EVENT_SUBSCRIPTION_CACHE_TTL = float(os.getenv("EVENT_SUBSCRIPTION_CACHE_TTL", 60))
+
+# Outbox events relayed to the workers per transaction, and seconds the relay waits when the outbox is empty
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", 1000))
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", 0.5))
+# Max seconds the relay waits after a failure, the wait doubles from OUTBOX_POLL_INTERVAL with every failure
+OUTBOX_MAX_BACKOFF = float(os.getenv("OUTBOX_MAX_BACKOFF", 60))